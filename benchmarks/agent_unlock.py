@@ -0,0 +1,100 @@
+"""
+Time to read one entry when every lookup unlocks the vault with the master
+password, against asking an unlock agent holding the key, and decrypting a
+whole vault locally against through the agent.
+
+The agent runs on a temporary socket in this process, so nothing else is touched.
+
+Run from the repository root:
+    python -m benchmarks.agent_unlock [lookups]
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from modules import agent, vault
+
+PASSWORD = b"benchmark"
+
+ENTRIES = 5000
+
+
+def create_vault(path: str):
+    v = vault.Vault(path)
+    v.open()
+    # the default Argon2 parameters, as a vault created without calibration
+    v.initialize(PASSWORD)
+    for _ in v.load_index():
+        pass
+    for _ in v.add_entries((f"title {i}", f"user{i}", f"password {i}") for i in range(ENTRIES)):
+        pass
+    v.close()
+
+
+def lookup_with_password(path: str):
+    v = vault.Vault(path)
+    v.open()
+    v.unlock(PASSWORD)
+    v.get_entry(1)
+    v.close()
+
+
+def lookup_with_agent(path: str, socket_path: str):
+    v = vault.Vault(path)
+    v.open()
+    client = agent.connect(socket_path)
+    key_id = v.get_keycheck().hex()
+    assert client.has(key_id)
+    v.cipher = agent.AgentCipher(client, key_id, v.get_cipher())
+    v.get_entry(1)
+    v.close()
+    client.close()
+
+
+def timed(function, runs: int) -> float:
+    start = time.perf_counter()
+    for _ in range(runs):
+        function()
+    return (time.perf_counter() - start) / runs
+
+
+def main(lookups: int):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "vault.db")
+        socket_path = os.path.join(directory, "agent", agent.SOCKET_NAME)
+        create_vault(path)
+
+        server = agent.Agent(socket_path)
+        thread = threading.Thread(target=server.run)
+        thread.start()
+
+        try:
+            v = vault.Vault(path)
+            v.open()
+            key = v.derive_key(PASSWORD)
+            client = agent.connect(socket_path)
+            client.add(v.get_keycheck().hex(), key)
+
+            print(f"{'':32}{'ms':>10}")
+            print(f"{'lookup, master password':32}{timed(lambda: lookup_with_password(path), 3) * 1000:10.1f}")
+            print(f"{'lookup, agent':32}{timed(lambda: lookup_with_agent(path, socket_path), lookups) * 1000:10.1f}")
+
+            local = v.new_cipher(v.get_cipher(), key)
+            remote = agent.AgentCipher(client, v.get_keycheck().hex(), v.get_cipher())
+            for name, cipher in (("local", local), ("agent", remote)):
+                v.cipher = cipher
+                seconds = timed(lambda: sum(1 for _ in v.iter_entries()), 3)
+                print(f"{f'decrypt {ENTRIES} entries, {name}':32}{seconds * 1000:10.1f}")
+
+            v.cipher = None
+            v.close()
+            client.stop()
+        finally:
+            thread.join()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
@@ -0,0 +1,80 @@
+"""
+Cold start of the command line against the GUI: wall time of a fresh
+interpreter running each command, best of several runs.
+
+The vault uses the cheapest key derivation so that import and startup
+time are measured rather than Argon2.
+
+Run from the repository root:
+    python -m benchmarks.cli_startup [runs]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from modules import vault
+
+PASSWORD = b"benchmark"
+
+# key derivation far too weak for real vaults
+KDF = {"time_cost": 1, "memory_cost": 8, "parallelism": 1}
+
+# main.py as run by users, up to the window being shown; the event loop returns at once
+GUI = """
+import runpy
+from PyQt6.QtWidgets import QApplication
+QApplication.exec = lambda app: app.processEvents() or 0
+runpy.run_path("main.py", run_name="__main__")
+"""
+
+
+def create_vault(path: str, count: int = 100):
+    v = vault.Vault(path)
+    v.open()
+    v.initialize(PASSWORD, KDF)
+    for _ in v.load_index():
+        pass
+    for _ in v.add_entries((f"title {i}", f"user{i}", f"password {i}") for i in range(count)):
+        pass
+    v.close()
+
+
+def best(command: list, runs: int, stdin: bytes = b"") -> float:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, input=stdin, check=True, capture_output=True)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(runs: int):
+    python = sys.executable
+
+    # the window is created without a display server
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "vault.db")
+        create_vault(path)
+        stdin = PASSWORD + b"\n"
+
+        cases = (
+            ("python -c pass", [python, "-c", "pass"], b""),
+            ("GUI window shown", [python, "-c", GUI], b""),
+            ("cli generate", [python, "-m", "cli", "generate"], b""),
+            ("cli list", [python, "-m", "cli", "list", path], stdin),
+            ("cli get", [python, "-m", "cli", "get", path, "title 42"], stdin),
+        )
+
+        print(f"best of {runs}")
+        print(f"{'':24}{'ms':>8}")
+        for name, command, data in cases:
+            print(f"{name:24}{best(command, runs, data) * 1000:8.0f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
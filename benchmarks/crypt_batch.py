@@ -0,0 +1,67 @@
+"""
+Throughput of one call per message against encrypt_many/decrypt_many,
+in rows/s and MB/s, for each cipher and message size.
+
+Run from the repository root:
+    python -m benchmarks.crypt_batch [messages]
+"""
+
+import os
+import sys
+import time
+
+from modules import crypt
+
+# a packed vault record, and a large note
+SIZES = (96, 4096)
+
+HEADER = b"\x00" * 8
+
+
+def timed(function) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def report(name: str, seconds: float, count: int, size: int):
+    print(f"  {name:28}{count / seconds:12.0f}{count * size / seconds / 1e6:10.1f}")
+
+
+def main(count: int):
+    workers = os.cpu_count() or 1
+
+    for cipher_name, cipher_class in crypt.CIPHERS.items():
+        cipher = cipher_class(os.urandom(32))
+
+        for size in SIZES:
+            messages = [os.urandom(size) for _ in range(count)]
+            headers = [HEADER] * count
+            sealed = cipher.encrypt_many(messages, headers)
+
+            print(f"{cipher_name}, {count} messages of {size} bytes")
+            print(f"  {'':28}{'rows/s':>12}{'MB/s':>10}")
+
+            report("encrypt per call", timed(lambda: [cipher.encrypt(m, HEADER) for m in messages]), count, size)
+            report("encrypt_many", timed(lambda: cipher.encrypt_many(messages, headers)), count, size)
+            if workers > 1:
+                report(
+                    f"encrypt_many, {workers} workers",
+                    timed(lambda: cipher.encrypt_many(messages, headers, workers)),
+                    count,
+                    size,
+                )
+
+            report("decrypt per call", timed(lambda: [cipher.decrypt(c, HEADER) for c in sealed]), count, size)
+            report("decrypt_many", timed(lambda: cipher.decrypt_many(sealed, headers)), count, size)
+            if workers > 1:
+                report(
+                    f"decrypt_many, {workers} workers",
+                    timed(lambda: cipher.decrypt_many(sealed, headers, workers)),
+                    count,
+                    size,
+                )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20_000)
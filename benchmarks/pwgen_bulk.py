@@ -0,0 +1,61 @@
+"""
+Throughput of generating passwords and passphrases one secrets.choice per
+character or word, as pwgen used to, against the batched generators and a
+password policy requiring every class.
+
+Run from the repository root:
+    python -m benchmarks.pwgen_bulk [count]
+"""
+
+import secrets
+import sys
+import time
+
+from modules import pwgen
+from modules.pwpolicy import CLASSES, Policy
+
+
+def per_choice_password(length: int = 24) -> str:
+    # rebuilds the alphabet and draws each character on its own
+    chars = pwgen.alphabet()
+    return "".join(secrets.choice(chars) for _ in range(length))
+
+
+def rejected_password(length: int = 24) -> str:
+    # regenerates until every class appears
+    while True:
+        password = per_choice_password(length)
+        if all(any(c in chars for c in password) for _, chars in CLASSES.values()):
+            return password
+
+
+def per_choice_passphrase(wordlist, length: int = 6) -> str:
+    return "-".join(secrets.choice(wordlist) for _ in range(length))
+
+
+def rate(function, count: int) -> float:
+    start = time.perf_counter()
+    function()
+    return count / (time.perf_counter() - start)
+
+
+def main(count: int):
+    wordlist = pwgen.get_wordlist()
+    policy = Policy(24, dict.fromkeys(CLASSES, 1))
+
+    print(f"{count} of each")
+    print(f"{'':36}{'per second':>12}")
+    for name, function in (
+        ("password, secrets.choice", lambda: [per_choice_password() for _ in range(count)]),
+        ("password, generate_password", lambda: [pwgen.generate_password() for _ in range(count)]),
+        ("password, generate_passwords", lambda: list(pwgen.generate_passwords(count))),
+        ("password, every class, rejection", lambda: [rejected_password() for _ in range(count)]),
+        ("password, Policy.generate_many", lambda: list(policy.generate_many(count))),
+        ("passphrase, secrets.choice", lambda: [per_choice_passphrase(wordlist) for _ in range(count)]),
+        ("passphrase, generate_passphrases", lambda: list(pwgen.generate_passphrases(count))),
+    ):
+        print(f"{name:36}{rate(function, count):12.0f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
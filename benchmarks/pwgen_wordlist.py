@@ -0,0 +1,65 @@
+"""
+Startup cost of the passphrase wordlist: time to import modules.pwgen, time of
+the first and later passphrases, and peak RSS. Compared with reading the text
+wordlist into a list of str at import time, as pwgen used to.
+Each case runs in a fresh interpreter.
+
+Run from the repository root:
+    python -m benchmarks.pwgen_wordlist
+"""
+
+import subprocess
+import sys
+
+# statements run on import, and the passphrase they generate
+CASES = {
+    "text list at import": (
+        "from modules import pwgen\n"
+        "with open(pwgen.WORDS_LIST_FILE) as file:\n"
+        "    words = [x for x in file.read().split() if len(x) >= 5]\n",
+        "'-'.join(secrets.choice(words) for _ in range(6))",
+    ),
+    "packed, lazy": (
+        "from modules import pwgen\n",
+        "pwgen.generate_passphrase()",
+    ),
+}
+
+SCRIPT = """
+import resource, secrets, time
+start = time.perf_counter()
+{setup}
+imported = time.perf_counter() - start
+
+start = time.perf_counter()
+{generate}
+first = time.perf_counter() - start
+
+start = time.perf_counter()
+for _ in range(1000):
+    {generate}
+later = (time.perf_counter() - start) / 1000
+
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(imported, first, later, rss)
+"""
+
+
+def main():
+    # compile the packed list beforehand, so the runs measure a normal start
+    subprocess.run([sys.executable, "-c", "from modules import pwgen; pwgen.get_wordlist()"], check=True)
+
+    print(f"{'':24}{'import (ms)':>12}{'first (ms)':>12}{'later (us)':>12}{'max RSS (MiB)':>15}")
+    for name, (setup, generate) in CASES.items():
+        output = subprocess.run(
+            [sys.executable, "-c", SCRIPT.format(setup=setup, generate=generate)],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        imported, first, later, rss = map(float, output.split())
+        print(f"{name:24}{imported * 1000:12.1f}{first * 1000:12.1f}{later * 1e6:12.1f}{rss:15.1f}")
+
+
+if __name__ == "__main__":
+    main()
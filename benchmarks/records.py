@@ -0,0 +1,62 @@
+"""
+Compare encrypting entries field by field (schema version 2 and earlier)
+with sealing them as one record (schema version 3): time and bytes per entry.
+
+Run from the repository root:
+    python -m benchmarks.records [entries]
+"""
+
+import sys
+import time
+
+from modules import crypt, vault
+
+
+def entries(count: int):
+    return [(f"title {i}", f"user{i}@example.com", f"correct-horse-{i}") for i in range(count)]
+
+
+def bench_fields(aes, rows):
+    start = time.perf_counter()
+    sealed = [tuple(aes.encrypt(field.encode()) for field in row) for row in rows]
+    encrypt = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for fields in sealed:
+        tuple(aes.decrypt(field).decode() for field in fields)
+    decrypt = time.perf_counter() - start
+
+    size = sum(len(field) for fields in sealed for field in fields)
+    return encrypt, decrypt, size
+
+
+def bench_records(v, rows):
+    start = time.perf_counter()
+    sealed = [v.encrypt_record(i, *row) for i, row in enumerate(rows)]
+    encrypt = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i, record in enumerate(sealed):
+        v.decrypt_record(i, record)
+    decrypt = time.perf_counter() - start
+
+    size = sum(len(record) for record in sealed)
+    return encrypt, decrypt, size
+
+
+def main(count: int):
+    rows = entries(count)
+    aes = crypt.AESGCM(crypt.AESGCM.generate_key())
+
+    v = vault.Vault(":memory:")
+    v.cipher = aes
+
+    print(f"{count} entries")
+    print(f"{'':12}{'encrypt (us)':>14}{'decrypt (us)':>14}{'bytes':>8}")
+    for name, result in (("fields", bench_fields(aes, rows)), ("record", bench_records(v, rows))):
+        encrypt, decrypt, size = result
+        print(f"{name:12}{encrypt / count * 1e6:14.1f}{decrypt / count * 1e6:14.1f}{size / count:8.1f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20_000)
@@ -0,0 +1,139 @@
+"""
+Compare the tuned connection layer (modules.db) against plain sqlite3 defaults
+on the operations a vault performs: opening, single-row writes and batched writes.
+Rows hold random blobs the size of sealed records, so only the database is measured.
+
+Run from the repository root:
+    python -m benchmarks.vault_db [rows]
+"""
+
+import os
+import sys
+import sqlite3
+import tempfile
+import time
+
+from modules import db, vault
+
+# size of a sealed record: nonce, packed fields of a typical entry, tag
+RECORD_SIZE = 96
+
+OPENS = 50
+SINGLE_WRITES = 300
+
+
+def random_row():
+    now = int(time.time())
+    return (os.urandom(RECORD_SIZE), now, now)
+
+
+def open_default(path):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.executescript(vault.DB_SCHEMA)
+    conn.commit()
+    return conn
+
+
+def open_tuned(path):
+    conn = db.connect(path)
+    if db.get_schema_version(conn) == 0:
+        db.create_schema(conn, vault.DB_SCHEMA, vault.SCHEMA_VERSION)
+    return conn
+
+
+def fill(conn, rows):
+    conn.executemany(
+        "INSERT INTO entries (record, created, modified) VALUES (?, ?, ?)",
+        (random_row() for _ in range(rows)),
+    )
+
+
+def timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def bench_open(path, opener):
+    def run():
+        for _ in range(OPENS):
+            conn = opener(path)
+            conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+            conn.close()
+
+    return timed(run) / OPENS
+
+
+def bench_single_default(conn):
+    def run():
+        for _ in range(SINGLE_WRITES):
+            conn.execute("INSERT INTO entries (record, created, modified) VALUES (?, ?, ?)", random_row())
+            conn.commit()
+
+    return SINGLE_WRITES / timed(run)
+
+
+def bench_single_tuned(conn):
+    def run():
+        for _ in range(SINGLE_WRITES):
+            with db.transaction(conn):
+                conn.execute("INSERT INTO entries (record, created, modified) VALUES (?, ?, ?)", random_row())
+
+    return SINGLE_WRITES / timed(run)
+
+
+def bench_batched(conn, rows):
+    def run():
+        with db.transaction(conn):
+            for _ in range(rows):
+                conn.execute("INSERT INTO entries (record, created, modified) VALUES (?, ?, ?)", random_row())
+
+    return rows / timed(run)
+
+
+def bench_scan(conn):
+    def run():
+        for _ in conn.execute("SELECT id, record FROM entries"):
+            pass
+
+    return timed(run)
+
+
+def main(rows: int):
+    with tempfile.TemporaryDirectory() as directory:
+        default_path = os.path.join(directory, "default.db")
+        tuned_path = os.path.join(directory, "tuned.db")
+
+        conn = open_default(default_path)
+        fill(conn, rows)
+        conn.commit()
+        conn.close()
+
+        conn = open_tuned(tuned_path)
+        with db.transaction(conn):
+            fill(conn, rows)
+        conn.close()
+
+        print(f"vault with {rows} entries")
+        print(f"{'':28}{'default':>12}{'tuned':>12}")
+
+        default, tuned = bench_open(default_path, open_default), bench_open(tuned_path, open_tuned)
+        print(f"{'open (ms)':28}{default * 1000:12.2f}{tuned * 1000:12.2f}")
+
+        default_conn, tuned_conn = open_default(default_path), open_tuned(tuned_path)
+
+        default, tuned = bench_scan(default_conn), bench_scan(tuned_conn)
+        print(f"{'full scan (ms)':28}{default * 1000:12.2f}{tuned * 1000:12.2f}")
+
+        default, tuned = bench_single_default(default_conn), bench_single_tuned(tuned_conn)
+        print(f"{'single-row writes (rows/s)':28}{default:12.0f}{tuned:12.0f}")
+
+        tuned = bench_batched(tuned_conn, SINGLE_WRITES * 10)
+        print(f"{'batched writes (rows/s)':28}{'':>12}{tuned:12.0f}")
+
+        default_conn.close()
+        tuned_conn.close()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
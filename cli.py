@@ -0,0 +1,360 @@
+#! /usr/bin/env python3
+"""
+Command line access to vaults without the GUI:
+    python -m cli list VAULT [QUERY]
+    python -m cli get VAULT QUERY [--field FIELD]
+    python -m cli add VAULT TITLE [USERNAME] [--generate]
+    python -m cli audit VAULT
+    python -m cli generate [pwgen options]
+    python -m cli agent start|add VAULT|lock|stop|status
+    python -m cli settings [NAME [VALUE]]
+
+The master password, then the password of a new entry, are asked on the
+terminal, or read one per line from stdin when it is not a terminal.
+Vaults whose key was given to the unlock agent (python -m cli agent add)
+are opened without the master password while the agent runs.
+
+Modules are imported by the commands that use them, so looking up an entry
+never loads Qt, zxcvbn or requests.
+"""
+
+import argparse
+import getpass
+import json
+import os
+import sys
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+HIBP_CACHE_DIR = os.path.join(DATA_DIR, "hibp")
+
+# exit status of a failed command, and of an audit that found problems
+EXIT_ERROR = 1
+EXIT_PROBLEMS = 2
+
+
+class CommandError(Exception):
+    pass
+
+
+def read_secret(prompt: str) -> str:
+    """
+    :param prompt: Shown when asking on the terminal
+    :return: Secret typed on the terminal, or the next line of stdin
+    """
+    if sys.stdin.isatty():
+        return getpass.getpass(prompt)
+
+    line = sys.stdin.readline()
+    if not line:
+        raise CommandError(f"{prompt.rstrip(': ')} expected on stdin")
+    return line.rstrip("\n")
+
+
+def run(steps):
+    """
+    Drive a generator yielding (status, done, total), reporting each new status on stderr
+    """
+    last = None
+    for status, _, _ in steps:
+        if status != last:
+            print(f"{status}...", file=sys.stderr)
+            last = status
+
+
+def open_vault(path: str, index: bool = True, use_agent: bool = True):
+    """
+    Open, unlock and upgrade a vault
+    :param path: Path of the vault
+    :param index: Also load the search index
+    :param use_agent: Let the unlock agent decrypt, if it has the key of the vault
+    :return: Unlocked vault.Vault
+    """
+    from modules import vault
+
+    # opening a missing path would create an empty vault
+    if not os.path.isfile(path):
+        raise CommandError(f"No vault at {path}")
+
+    v = vault.Vault(path)
+    v.open()
+
+    try:
+        cipher = agent_cipher(v) if use_agent else None
+        if cipher is not None:
+            v.cipher = cipher
+        elif v.unlock(read_secret("Master password: ").encode()):
+            raise CommandError("Wrong password")
+
+        run(v.migrate())
+        if index:
+            run(v.load_index())
+    except BaseException:
+        v.close()
+        raise
+
+    return v
+
+
+def agent_cipher(v):
+    """
+    :param v: Open vault.Vault
+    :return: agent.AgentCipher for the vault, None if no agent is running or it lacks the key
+    """
+    from modules import agent
+
+    try:
+        client = agent.connect()
+    except agent.AgentError as e:
+        # the master password still works
+        print(f"Not using the agent: {e}", file=sys.stderr)
+        return None
+    if client is None:
+        return None
+
+    key_id = v.get_keycheck().hex()
+    try:
+        has = client.has(key_id)
+    except agent.AgentError as e:
+        # an agent that is exiting
+        print(f"Not using the agent: {e}", file=sys.stderr)
+        has = False
+    if not has:
+        client.close()
+        return None
+
+    return agent.AgentCipher(client, key_id, v.get_cipher())
+
+
+def find_entry(v, query: str) -> int:
+    """
+    :param v: Unlocked vault.Vault with its index loaded
+    :param query: Search text, or #id
+    :return: Id of the only entry matching, or whose title is query
+    """
+    if query.startswith("#") and query[1:].isdigit():
+        return int(query[1:])
+
+    ids = v.search(query)
+    if len(ids) > 1:
+        exact = [entry_id for entry_id in ids if v.get_title(entry_id).lower() == query.lower()]
+        if len(exact) == 1:
+            return exact[0]
+
+        titles = "\n".join(f"  #{entry_id} {v.get_title(entry_id)}" for entry_id in ids)
+        raise CommandError(f"{len(ids)} entries match {query!r}:\n{titles}")
+
+    if not ids:
+        raise CommandError(f"No entry matches {query!r}")
+
+    return ids[0]
+
+
+def list_entries(args):
+    v = open_vault(args.vault)
+    try:
+        for entry_id in v.search(args.query):
+            title, username, _ = v.get_entry(entry_id)
+            print(f"{entry_id}\t{title}\t{username}")
+    finally:
+        v.close()
+
+
+def get_entry(args):
+    v = open_vault(args.vault)
+    try:
+        entry_id = find_entry(v, args.query)
+        try:
+            title, username, password = v.get_entry(entry_id)
+        except KeyError:
+            raise CommandError(f"No entry #{entry_id}")
+    finally:
+        v.close()
+
+    fields = {"title": title, "username": username, "password": password}
+    print(fields[args.field])
+
+
+def add_entry(args):
+    # before unlocking, so a bad policy fails without asking for anything
+    if args.generate:
+        from modules import pwgen
+        password = pwgen.generate_password(length=args.length)
+
+    v = open_vault(args.vault)
+    try:
+        if not args.generate:
+            password = read_secret("Entry password: ")
+        entry_id = v.add_entry(args.title, args.username, password)
+    finally:
+        v.close()
+
+    print(entry_id)
+
+
+def audit(args):
+    from modules import health, hibpcache, pwquality
+    from modules.settings import get_settings
+
+    dataset = get_settings().get("hibp_dataset")
+    if dataset:
+        pwquality.set_offline_dataset(dataset)
+
+    v = open_vault(args.vault, index=False)
+    try:
+        cache = pwquality.ScoreCache(v.subkey(b"scores"), v.get_secret("scores"))
+
+        checked = 0
+        problems = 0
+        unknown = 0
+        for result in health.check(v.iter_entries(), cache, hibp_cache=hibpcache.RangeCache(HIBP_CACHE_DIR)):
+            # reported once its breach count is known
+            if result.breaches == health.BREACHES_PENDING:
+                continue
+            checked += 1
+            unknown += result.breaches < 0
+            if not health.is_problem(result):
+                continue
+            problems += 1
+            print(f"#{result.entry_id} {result.title} ({result.username}): {', '.join(health.describe(result))}")
+
+        # unchanged passwords are not scored again next time
+        cache.prune()
+        v.set_secret("scores", cache.dumps())
+    finally:
+        v.close()
+
+    print(f"{problems} of {checked} entries have problems", file=sys.stderr)
+    if unknown:
+        print(f"Breach check unavailable for {unknown} passwords", file=sys.stderr)
+    return EXIT_PROBLEMS if problems else 0
+
+
+def agent_command(args):
+    from modules import agent
+
+    if args.action == "start":
+        agent.start(idle_timeout=args.timeout).close()
+        print(agent.default_socket_path())
+
+    elif args.action == "add":
+        if args.vault is None:
+            raise CommandError("agent add needs a vault")
+
+        from modules import vault
+
+        if not os.path.isfile(args.vault):
+            raise CommandError(f"No vault at {args.vault}")
+
+        v = vault.Vault(args.vault)
+        v.open()
+        try:
+            key = v.derive_key(read_secret("Master password: ").encode())
+            if key is None:
+                raise CommandError("Wrong password")
+
+            client = agent.start(idle_timeout=args.timeout)
+            if not client.add(v.get_keycheck().hex(), key):
+                print("Warning: the agent could not lock the key in memory", file=sys.stderr)
+            del key
+        finally:
+            v.close()
+
+    else:
+        client = agent.connect()
+        if client is None:
+            print("No agent running", file=sys.stderr)
+            return EXIT_ERROR
+
+        if args.action == "lock":
+            client.lock_keys()
+        elif args.action == "stop":
+            client.stop()
+        else:
+            print(f"Agent running at {agent.default_socket_path()}")
+
+
+def settings_command(args):
+    from modules.settings import DEFAULTS, get_settings
+
+    settings = get_settings()
+
+    if args.name is None:
+        for name, value in sorted({**DEFAULTS, **settings.values}.items()):
+            print(f"{name}\t{json.dumps(value)}")
+    elif args.value is None:
+        print(json.dumps(settings.get(args.name)))
+    else:
+        # JSON values, anything else is a string
+        try:
+            value = json.loads(args.value)
+        except ValueError:
+            value = args.value
+        settings.set(args.name, value)
+
+
+def main(argv: list = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+
+    # pwgen parses its own options
+    if argv[:1] == ["generate"]:
+        from modules import pwgen
+        pwgen.main(argv[1:], prog="python -m cli generate")
+        return 0
+
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Use a vault without the GUI")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("list", help="list entries as id, title and username")
+    command.add_argument("vault")
+    command.add_argument("query", nargs="?", default="", help="only entries whose title or username contains this")
+    command.set_defaults(function=list_entries)
+
+    command = commands.add_parser("get", help="print a field of one entry")
+    command.add_argument("vault")
+    command.add_argument("query", help="text matching a single entry, its exact title, or #id")
+    command.add_argument("-f", "--field", choices=("password", "username", "title"), default="password")
+    command.set_defaults(function=get_entry)
+
+    command = commands.add_parser("add", help="add an entry and print its id")
+    command.add_argument("vault")
+    command.add_argument("title")
+    command.add_argument("username", nargs="?", default="")
+    command.add_argument("-g", "--generate", action="store_true", help="generate the password instead of reading it")
+    command.add_argument("-l", "--length", type=int, default=24, help="length of a generated password (default 24)")
+    command.set_defaults(function=add_entry)
+
+    command = commands.add_parser("audit", help=f"report weak, breached and reused passwords, exit status {EXIT_PROBLEMS} if any")
+    command.add_argument("vault")
+    command.set_defaults(function=audit)
+
+    commands.add_parser("generate", help="generate passwords, see python -m cli generate --help")
+
+    command = commands.add_parser("agent", help="keep vault keys unlocked in a background agent")
+    command.add_argument("action", choices=("start", "add", "lock", "stop", "status"))
+    command.add_argument("vault", nargs="?", help="vault whose key to add")
+    command.add_argument("--timeout", type=float, default=15 * 60, help="idle seconds before the agent exits (default 900)")
+    command.set_defaults(function=agent_command)
+
+    command = commands.add_parser("settings", help="show or change the settings shared with the GUI")
+    command.add_argument("name", nargs="?")
+    command.add_argument("value", nargs="?", help="new value, as JSON or a plain string")
+    command.set_defaults(function=settings_command)
+
+    args = parser.parse_args(argv)
+
+    try:
+        return args.function(args) or 0
+    except BrokenPipeError:
+        # the reader stopped early, as head does; nothing more can be written
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return EXIT_ERROR
+    except (CommandError, ValueError, OSError) as e:
+        print(f"{parser.prog}: {e}", file=sys.stderr)
+        return EXIT_ERROR
+    except KeyboardInterrupt:
+        return EXIT_ERROR
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,32 +1,113 @@
 #! /usr/bin/env python3
 
-import json
 import os
 import sys
 
 import pyperclip
-from modules import pwgen, pwquality, vault
-from PyQt6.QtWidgets import (QApplication, QFileDialog, QLabel, QMessageBox,
-                             QPushButton)
+from modules import (backup, crypt, health, hibpcache, importer, pwgen, pwquality,
+                     vault)
+from modules.settings import get_settings, load_stylesheet
+from PyQt6.QtCore import Qt
+from PyQt6.QtWidgets import (QApplication, QFileDialog, QInputDialog, QLabel,
+                             QMessageBox, QProgressDialog)
 from ui.entry import EntryDialog
 from ui.pw import PasswordDialog
 from ui.window import VaultWindow
+from ui.worker import Worker
+
+HIBP_CACHE = hibpcache.RangeCache(os.path.join(os.path.dirname(__file__), "data", "hibp"))
+
+
+def unlock_vault(v: vault.Vault, password: bytes, create: bool):
+    """
+    Open, unlock and index a vault off the GUI thread.
+    Yields (status, done, total) and returns False on a wrong password.
+    """
+    if create:
+        yield ("Calibrating key derivation", 0, 0)
+        kdf = crypt.argon2_calibrate()
+
+        yield ("Choosing cipher", 0, 0)
+        cipher = crypt.recommend_cipher()
+
+    yield ("Deriving key", 0, 0)
+
+    v.open()
+    if create:
+        v.initialize(password, kdf, cipher)
+    elif v.unlock(password):
+        return False
+
+    yield from v.migrate()
+    yield from v.load_index()
+
+    return True
+
+
+def rekey_vault(v: vault.Vault, password: bytes):
+    """
+    Re-derive the key of an open vault with freshly calibrated parameters.
+    Yields (status, done, total).
+    """
+    yield ("Calibrating key derivation", 0, 0)
+    kdf = crypt.argon2_calibrate()
+
+    yield from v.rekey(password, kdf)
+
+
+def import_entries(v: vault.Vault, path: str):
+    """
+    Stream a CSV or JSON export into an open vault.
+    Yields (status, done, total) and returns the number of entries imported.
+    """
+    reader = importer.read_json if path.lower().endswith(".json") else importer.read_csv
+
+    with open(path, "r", newline="", encoding="utf-8-sig") as file:
+        return (yield from v.add_entries(reader(file)))
+
+
+def export_backup(v: vault.Vault, path: str, password: bytes):
+    """
+    Write a backup next to path and move it into place once complete.
+    Yields (status, done, total) and returns the number of entries written.
+    """
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "wb") as file:
+            count = yield from backup.export(v, file, password)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    return count
+
+
+def restore_backup(v: vault.Vault, path: str, password: bytes):
+    """
+    Add the entries of a backup to an open vault.
+    Yields (status, done, total) and returns the number of entries restored.
+    """
+    with open(path, "rb") as file:
+        return (yield from backup.restore(v, file, password))
 
 
 class AppWindow(VaultWindow):
     def __init__(self):
         super().__init__()
 
+        # set before the dropdown is connected, so showing the saved theme does not save it again
+        self.theme_dropdown.setCurrentText(get_settings().get("stylesheet"))
+
         # build widget event connections
         self.build_connections()
 
         # initialize
         self.vault = None
-        self.entries = {}
-        self.entry_buttons = {}
         self.current_entry_id = None
-
-        self.theme_dropdown.setCurrentText(stylesheet[:-4])
+        self.worker = None
+        self.quality_worker = None
+        self.health_report = {}
 
     def build_connections(self):
 
@@ -39,12 +120,19 @@ class AppWindow(VaultWindow):
         self.add_btn.clicked.connect(self.add_entry)
         self.edit_btn.clicked.connect(self.edit_entry)
         self.delete_btn.clicked.connect(self.delete_entry)
+        self.entry_list.selectionModel().currentChanged.connect(self.on_entry_changed)
+        self.search_edit.textChanged.connect(self.filter_entries)
 
         # menu bar
+        self.menu_rekey.triggered.connect(self.change_master_password)
+        self.menu_cipher.triggered.connect(self.change_cipher)
+        self.menu_export.triggered.connect(self.export_backup)
+        self.menu_restore.triggered.connect(self.restore_backup)
         self.menu_close.triggered.connect(self.close)
         self.menu_add.triggered.connect(self.add_entry)
         self.menu_edit.triggered.connect(self.edit_entry)
         self.menu_delete.triggered.connect(self.delete_entry)
+        self.menu_import.triggered.connect(self.import_entries)
         self.menu_generator.triggered.connect(self.show_generator)
         self.menu_health.triggered.connect(self.show_quality)
 
@@ -64,70 +152,127 @@ class AppWindow(VaultWindow):
         self.ph_back_btn.clicked.connect(self.show_vault)
 
         # quality screen
+        self.quality_back_btn.clicked.connect(self.cancel_quality_check)
         self.quality_back_btn.clicked.connect(self.show_vault)
 
     def change_theme(self, name: str):
-        with open(
-            os.path.join(os.path.dirname(__file__), "data", "settings.json"), "r"
-        ) as file:
-            settings = json.load(file)
-
-        settings["stylesheet"] = name
-        stylesheet = name + ".qss"
+        app.setStyleSheet(load_stylesheet(name))
+        get_settings().set("stylesheet", name)
 
-        with open(
-            os.path.join(os.path.dirname(__file__), "data", "settings.json"), "w"
-        ) as file:
-            json.dump(settings, file)
+    def run_quality_check(self):
+        assert self.vault is not None
 
-        with open(
-            os.path.join(os.path.dirname(__file__), "style", stylesheet), "r"
-        ) as f:
-            app.setStyleSheet(f.read())
+        # a new run replaces any unfinished one
+        self.cancel_quality_check()
 
-    def run_quality_check(self):
         # clear any previous results
         for i in reversed(range(self.quality_layout_inner.count())):
             w = self.quality_layout_inner.itemAt(i).widget()
             if w:
                 w.setParent(None)
+        self.quality_labels = {}
 
         # if there are no entries to display
-        if not self.entries:
+        if not self.vault.count_entries():
             self.quality_layout_inner.addWidget(QLabel("No entries in vault."))
             return
 
-        # check for weak passwords
-        weak_found = False
-        for eid, (title, username, password) in self.entries.items():
-            score = pwquality.pwquality(password)
-            if score < 3:
-                weak_found = True
-                label = QLabel(f"!! {title} ({username}) — score: {score}")
-                self.quality_layout_inner.addWidget(label)
-
-        # no weak passwords c:
-        if not weak_found:
-            self.quality_layout_inner.addWidget(
-                QLabel("All passwords look strong enough.")
-            )
+        self.quality_status = QLabel("Checking passwords...")
+        self.quality_layout_inner.addWidget(self.quality_status)
 
-        # check for pwned passwords
-        pwned_found = False
-        for eid, (title, username, password) in self.entries.items():
-            count = pwquality.check_pwned(password)
-            if count > 0:
-                pwned_found = True
-                label = QLabel(
-                    f"!! {title} ({username}) — exposed {count} times in data breaches"
-                )
-                self.quality_layout_inner.addWidget(label)
-
-        # no pwned passwords c:
-        if not pwned_found:
-            self.quality_layout_inner.addWidget(
-                QLabel("No passwords found in known breaches.")
-            )
+        # the last report is shown at once, then updated as results arrive
+        ids = set(self.vault.get_ids())
+        self.health_report = {
+            eid: result for eid, result in self.health_report.items() if eid in ids
+        }
+        for result in self.health_report.values():
+            self.show_health_result(result)
+
+        cache = pwquality.ScoreCache(
+            self.vault.subkey(b"scores"), self.vault.get_secret("scores")
+        )
+        # entries are decrypted by the worker, not here on the GUI thread, from a
+        # snapshot the vault menus cannot change under it
+        worker = Worker(
+            health.check,
+            self.vault.snapshot_entries(),
+            cache,
+            dict(self.health_report),
+            hibp_cache=HIBP_CACHE,
+        )
+        worker.signals.progress.connect(
+            lambda result: self.on_health_result(worker, result)
+        )
+        worker.signals.finished.connect(
+            lambda: self.on_health_finished(worker, cache)
+        )
+        self.quality_worker = worker
+        worker.start()
+
+    def cancel_quality_check(self):
+        if self.quality_worker is not None:
+            self.quality_worker.cancel()
+            self.quality_worker = None
+
+    def on_health_result(self, worker: Worker, result: health.Result):
+        if worker is not self.quality_worker:
+            return
+
+        self.health_report[result.entry_id] = result
+        self.show_health_result(result)
+
+    def show_health_result(self, result: health.Result):
+        label = self.quality_labels.pop(result.entry_id, None)
+
+        if not health.is_problem(result):
+            if label:
+                label.setParent(None)
+            return
+
+        if label is None:
+            label = QLabel()
+            self.quality_layout_inner.addWidget(label)
+        label.setText(f"!! {result.title} ({result.username}) — {', '.join(health.describe(result))}")
+        self.quality_labels[result.entry_id] = label
+
+    def on_health_finished(self, worker: Worker, cache: pwquality.ScoreCache):
+        if worker is not self.quality_worker:
+            return
+        self.quality_worker = None
+
+        if worker.exception:
+            self.quality_status.setText(f"Password check failed: {worker.exception}")
+            return
+
+        # unchanged passwords are not scored again next time
+        cache.prune()
+        self.vault.set_secret("scores", cache.dumps())
+
+        results = self.health_report.values()
+        weak = sum(result.score < 3 for result in results)
+        pwned = sum(result.breaches > 0 for result in results)
+        reused = sum(result.reused > 0 for result in results)
+        unknown = sum(result.breaches < 0 for result in results)
+
+        summary = []
+        summary.append(f"{weak} weak passwords." if weak else "All passwords look strong enough.")
+        summary.append(
+            f"{pwned} passwords found in known breaches." if pwned
+            else "No passwords found in known breaches."
+        )
+        summary.append(f"{reused} passwords reused." if reused else "No reused passwords.")
+
+        groups = {}
+        for result in results:
+            if result.similar >= 0:
+                groups.setdefault(result.similar, []).append(result.title)
+        for group, titles in sorted(groups.items()):
+            summary.append(f"Similar passwords (group {group + 1}): {', '.join(titles)}")
+        if not groups:
+            summary.append("No similar passwords.")
+        if unknown:
+            summary.append(f"Breach check unavailable for {unknown} passwords.")
+        self.quality_status.setText("\n".join(summary))
 
     def open_vault(self):
         path, _ = QFileDialog.getOpenFileName(
@@ -136,120 +281,280 @@ class AppWindow(VaultWindow):
         if not path:
             return
 
-        self.vault = vault.Vault(path)
+        pw_dialog = PasswordDialog(mode="open")
+        if pw_dialog.exec():
+            self.start_unlock(vault.Vault(path), pw_dialog.password, create=False)
+
+    def create_vault(self):
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Create Vault", "", "SQLite DB (*.db)"
+        )
+        if not path:
+            return
+
+        pw_dialog = PasswordDialog(mode="create")
+        if pw_dialog.exec():
+            self.start_unlock(vault.Vault(path), pw_dialog.password, create=True)
+
+    def start_unlock(self, v: vault.Vault, password: bytes, create: bool):
+        # key derivation and indexing run on the thread pool
+        self.start_worker(
+            Worker(unlock_vault, v, password, create),
+            "Deriving key",
+            lambda worker: self.on_unlock_finished(v, worker),
+        )
+
+    def change_master_password(self):
+        assert self.vault is not None
+
+        pw_dialog = PasswordDialog(mode="create")
+        if pw_dialog.exec():
+            self.start_worker(
+                Worker(rekey_vault, self.vault, pw_dialog.password),
+                "Deriving key",
+                self.on_rekey_finished,
+            )
+
+    def change_cipher(self):
+        assert self.vault is not None
+
+        current = self.vault.get_cipher()
+        recommended = crypt.recommend_cipher()
+        names = list(crypt.CIPHERS)
+        labels = [f"{name} (recommended)" if name == recommended else name for name in names]
+
+        label, ok = QInputDialog.getItem(
+            self,
+            "Change cipher",
+            f"Current cipher: {current}",
+            labels,
+            names.index(recommended),
+            False,
+        )
+        cipher = names[labels.index(label)] if ok else None
+        if cipher is None or cipher == current:
+            return
 
         pw_dialog = PasswordDialog(mode="open")
         if pw_dialog.exec():
-            pw = pw_dialog.password
+            self.start_worker(
+                Worker(self.vault.change_cipher, pw_dialog.password, cipher),
+                "Checking password",
+                self.on_cipher_finished,
+            )
 
-            self.vault.open()
+    def on_cipher_finished(self, worker: Worker):
+        if worker.exception:
+            QMessageBox.critical(
+                self,
+                "Error",
+                f"The cipher could not be changed: {worker.exception}",
+            )
+        elif not worker.cancelled:
+            QMessageBox.information(
+                self, "Vault", f"Entries are now encrypted with {self.vault.get_cipher()}."
+            )
 
-            if self.vault.unlock(pw):
-                QMessageBox.warning(
-                    self,
-                    "Incorrect Password",
-                    "The password you entered is incorrect. Please try again.",
-                )
-                self.vault.close()
-                return
+    def start_worker(self, worker: Worker, label: str, on_finished):
+        progress = QProgressDialog(label, "Cancel", 0, 0, self)
+        progress.setWindowTitle("Vault")
+        progress.setWindowModality(Qt.WindowModality.WindowModal)
+        progress.setMinimumDuration(0)
+        progress.setValue(0)
 
-            self.welcome_widget.hide()
-            self.vault_widget.show()
+        worker.signals.progress.connect(
+            lambda p: self.on_worker_progress(progress, *p)
+        )
+        worker.signals.finished.connect(
+            lambda: self.on_worker_finished(worker, progress, on_finished)
+        )
+        progress.canceled.connect(worker.cancel)
 
-            self.load_entries()
-            self.on_vault_open()
+        self.worker = worker
+        worker.start()
+
+    def on_worker_progress(self, progress, status: str, done: int, total: int):
+        progress.setLabelText(status)
+        progress.setMaximum(total)
+        progress.setValue(done)
+
+    def on_worker_finished(self, worker: Worker, progress, on_finished):
+        progress.canceled.disconnect(worker.cancel)
+        progress.close()
+        self.worker = None
+
+        on_finished(worker)
+
+    def export_backup(self):
+        assert self.vault is not None
 
-    def create_vault(self):
         path, _ = QFileDialog.getSaveFileName(
-            self, "Create Vault", "", "SQLite DB (*.db)"
+            self, "Export Backup", "", "Vault backup (*.vbak)"
         )
         if not path:
             return
 
-        self.vault = vault.Vault(path)
-
         pw_dialog = PasswordDialog(mode="create")
         if pw_dialog.exec():
-            pw = pw_dialog.password
+            self.start_worker(
+                Worker(export_backup, self.vault, path, pw_dialog.password),
+                "Exporting entries",
+                self.on_export_finished,
+            )
 
-            self.vault.open()
-            self.vault.initialize(pw)
+    def on_export_finished(self, worker: Worker):
+        if worker.exception:
+            QMessageBox.critical(
+                self,
+                "Error",
+                f"The backup could not be written: {worker.exception}",
+            )
+        elif not worker.cancelled:
+            QMessageBox.information(
+                self, "Backup", f"Exported {worker.value} entries."
+            )
 
-            self.welcome_widget.hide()
-            self.vault_widget.show()
+    def restore_backup(self):
+        assert self.vault is not None
 
-            self.load_entries()
-            self.on_vault_open()
+        path, _ = QFileDialog.getOpenFileName(
+            self, "Restore Backup", "", "Vault backup (*.vbak)"
+        )
+        if not path:
+            return
+
+        pw_dialog = PasswordDialog(mode="open")
+        if pw_dialog.exec():
+            self.start_worker(
+                Worker(restore_backup, self.vault, path, pw_dialog.password),
+                "Deriving key",
+                self.on_import_finished,
+            )
+
+    def on_rekey_finished(self, worker: Worker):
+        if worker.exception:
+            QMessageBox.critical(
+                self,
+                "Error",
+                f"The master password could not be changed: {worker.exception}",
+            )
+
+    def on_unlock_finished(self, v: vault.Vault, worker: Worker):
+        if worker.cancelled or worker.exception or not worker.value:
+            if v.conn is not None:
+                v.close()
+
+        if worker.cancelled:
+            return
+
+        if worker.exception:
+            QMessageBox.critical(
+                self,
+                "Error",
+                f"The vault could not be opened: {worker.exception}",
+            )
+            return
+
+        if not worker.value:
+            QMessageBox.warning(
+                self,
+                "Incorrect Password",
+                "The password you entered is incorrect. Please try again.",
+            )
+            return
+
+        self.vault = v
+        self.load_entries()
+        self.on_vault_open()
 
     def load_entries(self):
         assert self.vault is not None
 
-        self.entries.clear()
-        self.entry_buttons.clear()
-
-        # clear left pane
-        for i in reversed(range(self.left_layout.count())):
-            widget = self.left_layout.itemAt(i).widget()
-            if widget:
-                widget.setParent(None)
-
-        # get and decrypt all rows
-        rows = self.vault.get_rows()
-        for r in rows:
-            entry_id = r[0]
-            try:
-                title = self.vault.aes.decrypt(r[1]).decode()
-                username = self.vault.aes.decrypt(r[2]).decode()
-                password = self.vault.aes.decrypt(r[3]).decode()
-            except Exception:
-                title, username, password = "<decryption failed>", "", ""
-
-            # entries are clickable buttons
-            self.entries[entry_id] = (title, username, password)
-            btn = QPushButton(title)
-            btn.setCheckable(True)
-            btn.clicked.connect(lambda _, eid=entry_id: self.show_entry(eid))
-            self.left_layout.addWidget(btn)
-            self.entry_buttons[entry_id] = btn
+        self.current_entry_id = None
+        self.health_report = {}
+
+        self.search_edit.clear()
+
+        # titles are decrypted by the model as rows become visible
+        self.entry_model.loader = self.vault.get_title
+        self.entry_model.set_ids(self.vault.get_ids())
 
         # select first entry by default
-        if self.entries:
-            self.show_entry(list(self.entries.keys())[0])
+        self.show_first_entry()
+
+    def filter_entries(self, text: str):
+        if self.vault is None or self.vault.index is None:
+            return
+
+        self.entry_model.set_ids(self.vault.search(text))
+
+        # keep the current entry selected if it still matches
+        if self.current_entry_id in self.entry_model.rows:
+            self.show_entry(self.current_entry_id)
+        else:
+            self.show_first_entry()
+
+    def show_first_entry(self):
+        if self.entry_model.rowCount():
+            self.show_entry(self.entry_model.entry_id(0))
+        else:
+            self.clear_entry()
 
     def generate_password(self):
-        generated_password = pwgen.generate_password(
-            uppercase=self.chk_upper.isChecked(),
-            lowercase=self.chk_lower.isChecked(),
-            digits=self.chk_digits.isChecked(),
-            symbols=self.chk_symbols.isChecked(),
-            length=self.pw_length_slider.value(),
-        )
+        try:
+            generated_password = pwgen.generate_password(
+                uppercase=self.chk_upper.isChecked(),
+                lowercase=self.chk_lower.isChecked(),
+                digits=self.chk_digits.isChecked(),
+                symbols=self.chk_symbols.isChecked(),
+                length=self.pw_length_slider.value(),
+            )
+        except ValueError as e:
+            QMessageBox.warning(self, "Error", str(e))
+            return
         self.pw_output.setText(generated_password)
 
     def generate_passphrase(self):
-        generated_passphrase = pwgen.generate_passphrase(
-            length=self.ph_words_slider.value(), separator=self.ph_separator.text()
-        )
+        try:
+            generated_passphrase = pwgen.generate_passphrase(
+                length=self.ph_words_slider.value(), separator=self.ph_separator.text()
+            )
+        except OSError as e:
+            QMessageBox.warning(self, "Error", f"The wordlist could not be loaded: {e}")
+            return
         self.ph_output.setText(generated_passphrase)
 
+    def on_entry_changed(self, current, previous):
+        if current.isValid():
+            self.show_entry(self.entry_model.entry_id(current.row()))
+
     def show_entry(self, entry_id):
-        for eid, btn in self.entry_buttons.items():
-            btn.setChecked(eid == entry_id)
+        index = self.entry_model.index_of(entry_id)
+        if index != self.entry_list.currentIndex():
+            # the view reports the change back through on_entry_changed
+            self.entry_list.setCurrentIndex(index)
+            return
 
-        title, username, password = self.entries[entry_id]
+        title, username, password = self.vault.get_entry(entry_id)
         self.current_entry_id = entry_id
         self.detail_widgets["title"].setText(title)
         self.detail_widgets["username"].setText(username)
         self.detail_widgets["password"].setText(password)
 
+    def clear_entry(self):
+        self.current_entry_id = None
+        for widget in self.detail_widgets.values():
+            widget.setText("")
+
     def add_entry(self):
         assert self.vault is not None
 
         dlg = EntryDialog(self)
         if dlg.exec():
             title, username, password = dlg.get_data()
-            self.vault.add_entry(title, username, password)
-            self.load_entries()
+            entry_id = self.vault.add_entry(title, username, password)
+            self.entry_model.append(entry_id, title)
+            self.show_entry(entry_id)
 
     def edit_entry(self):
         assert self.vault is not None
@@ -257,12 +562,45 @@ class AppWindow(VaultWindow):
         if not self.current_entry_id:
             return
 
-        old_title, old_user, old_pass = self.entries[self.current_entry_id]
+        old_title, old_user, old_pass = self.vault.get_entry(self.current_entry_id)
         dlg = EntryDialog(self, old_title, old_user, old_pass)
         if dlg.exec():
             title, username, password = dlg.get_data()
             self.vault.edit_entry(self.current_entry_id, title, username, password)
-            self.load_entries()
+            self.entry_model.update(self.current_entry_id, title)
+            self.show_entry(self.current_entry_id)
+
+    def import_entries(self):
+        assert self.vault is not None
+
+        path, _ = QFileDialog.getOpenFileName(
+            self, "Import Entries", "", "Exports (*.csv *.json)"
+        )
+        if not path:
+            return
+
+        self.start_worker(
+            Worker(import_entries, self.vault, path),
+            "Importing entries",
+            self.on_import_finished,
+        )
+
+    def on_import_finished(self, worker: Worker):
+        if worker.exception:
+            QMessageBox.critical(
+                self,
+                "Error",
+                f"The entries could not be imported: {worker.exception}",
+            )
+            return
+
+        if worker.cancelled:
+            return
+
+        self.load_entries()
+        QMessageBox.information(
+            self, "Import", f"Imported {worker.value} entries."
+        )
 
     def delete_entry(self):
         assert self.vault is not None
@@ -278,18 +616,42 @@ class AppWindow(VaultWindow):
         )
 
         if confirm == QMessageBox.StandardButton.Yes:
-            self.vault.delete_entry(self.current_entry_id)
-            self.load_entries()
+            entry_id = self.current_entry_id
+            self.current_entry_id = None
+            self.vault.delete_entry(entry_id)
+            self.entry_model.remove(entry_id)
+
+            # the view moves the selection to a neighbouring row by itself
+            if not self.entry_list.currentIndex().isValid():
+                self.show_first_entry()
+
+    def closeEvent(self, event):
+        self.cancel_quality_check()
+
+        # closing the vault stores the search index for the next open
+        if self.vault is not None and self.vault.cipher is not None:
+            self.vault.close()
+            self.vault = None
+        super().closeEvent(event)
 
 
 if __name__ == "__main__":
-    with open(os.path.join(os.path.dirname(__file__), "data", "settings.json")) as file:
-        settings = json.load(file)
-    stylesheet = settings["stylesheet"] + ".qss"
+    settings = get_settings()
 
     app = QApplication([])
-    with open(os.path.join(os.path.dirname(__file__), "style", stylesheet), "r") as f:
-        app.setStyleSheet(f.read())
+    app.setStyleSheet(load_stylesheet(settings.get("stylesheet")))
+
+    # breach checks can be answered from a local dataset on offline machines
+    dataset = settings.get("hibp_dataset")
+    if dataset:
+        try:
+            pwquality.set_offline_dataset(dataset)
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(
+                None,
+                "Offline Breach Data",
+                f"The offline breach dataset could not be opened, the online service is used instead: {e}",
+            )
     win = AppWindow()
     win.show()
     sys.exit(app.exec())
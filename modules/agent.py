@@ -0,0 +1,501 @@
+"""
+Unlock agent: a background process keeping derived vault keys, so commands
+run in a row pay for Argon2 once instead of on every unlock.
+
+Clients talk to it over a Unix socket in a directory only the user can enter,
+and both ends check the other runs as the same user. The agent encrypts and
+decrypts on their behalf and never hands a key back. Keys are identified by
+the key check stored in the vault, so a vault with a new key is never served
+with the old one. Keys are held in locked memory, and the agent forgets them
+and exits once it goes unused for its idle timeout.
+
+Messages are JSON objects preceded by their length, with binary values in
+urlsafe base64:
+    {"op": "has", "key": id}                    -> {"ok": true, "has": bool}
+    {"op": "add", "key": id, "value": key}      -> {"ok": true}
+    {"op": "encrypt" or "decrypt", "key": id, "cipher": name,
+     "messages": [...], "headers": [...]}       -> {"ok": true, "messages": [...]}
+    {"op": "subkey", "key": id, "context": c}   -> {"ok": true, "value": subkey}
+    {"op": "lock"} forgets every key, {"op": "stop"} also exits
+Failures answer {"ok": false, "error": message}. Messages that fail to decrypt are null.
+
+python -m modules.agent runs an agent in the foreground.
+"""
+
+import argparse
+import ctypes
+import json
+import os
+import socket
+import socketserver
+import stat
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from modules import crypt
+
+# overrides the default socket path, like SSH_AUTH_SOCK
+SOCKET_ENV = "VAULT_AGENT_SOCK"
+
+SOCKET_NAME = "agent.sock"
+
+# seconds without a request before the agent forgets its keys and exits
+IDLE_TIMEOUT = 15 * 60
+
+# length of a message
+FRAME = struct.Struct(">I")
+
+# largest message either end accepts
+MAX_MESSAGE = 64 << 20
+
+# messages sent per encrypt or decrypt request
+REQUEST_BATCH = 4096
+
+# seconds a new agent has to start listening
+START_TIMEOUT = 5
+
+# Linux prctl option keeping other processes of the user from reading the agent's memory
+PR_SET_DUMPABLE = 4
+
+
+# failing to reach the agent safely, or a request it refused
+class AgentError(ConnectionError):
+    pass
+
+
+def default_socket_path() -> str:
+    """
+    :return: Socket path from SOCKET_ENV, else in a directory of the user under $XDG_RUNTIME_DIR or the temp dir
+    """
+    if os.environ.get(SOCKET_ENV):
+        return os.environ[SOCKET_ENV]
+
+    base = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return os.path.join(base, f"vault-agent-{os.getuid()}", SOCKET_NAME)
+
+
+def check_directory(path: str):
+    """
+    Refuse a socket directory another user could have created or could enter
+    :param path: Directory of the socket
+    """
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise AgentError(f"{path} must be a directory only the current user can access")
+
+
+def peer_uid(sock: socket.socket):
+    """
+    :return: User id of the process at the other end of a Unix socket, None where the platform cannot tell
+    """
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    _, uid, _ = struct.unpack("3i", creds)
+    return uid
+
+
+def send_message(sock: socket.socket, message: dict):
+    data = json.dumps(message).encode()
+    sock.sendall(FRAME.pack(len(data)) + data)
+
+
+def receive_exactly(sock: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(min(size - len(data), 1 << 20))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return bytes(data)
+
+
+def receive_message(sock: socket.socket) -> dict:
+    size, = FRAME.unpack(receive_exactly(sock, FRAME.size))
+    if size > MAX_MESSAGE:
+        raise AgentError("Message too large")
+    return json.loads(receive_exactly(sock, size))
+
+
+def encode(data) -> str:
+    return None if data is None else crypt.encode(data).decode()
+
+
+def decode(text: str) -> bytes:
+    return crypt.decode(text.encode())
+
+
+def protect_process():
+    """
+    Keep the agent out of core dumps and from being traced by other processes of the user, on Linux
+    """
+    if not sys.platform.startswith("linux"):
+        return
+
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.prctl(PR_SET_DUMPABLE, 0, 0, 0, 0)
+
+
+def lock_buffer(buffer: bytearray) -> bool:
+    """
+    Keep a buffer out of swap
+    :return: True if the buffer was locked
+    """
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        address = ctypes.addressof((ctypes.c_char * len(buffer)).from_buffer(buffer))
+        return libc.mlock(ctypes.c_void_p(address), ctypes.c_size_t(len(buffer))) == 0
+    except (OSError, AttributeError):
+        return False
+
+
+def wipe_buffer(buffer: bytearray):
+    buffer[:] = bytes(len(buffer))
+
+
+class Key:
+    """
+    Derived key held by the agent, and the ciphers built on it
+    """
+    def __init__(self, value: bytes):
+        # a bytearray can be locked and wiped, bytes cannot
+        self.value = bytearray(value)
+        self.locked = lock_buffer(self.value)
+        self.ciphers = {}
+
+    def cipher(self, name: str) -> crypt.AEAD:
+        if name not in crypt.CIPHERS:
+            raise AgentError(f"Unknown cipher: {name}")
+
+        if name not in self.ciphers:
+            self.ciphers[name] = crypt.CIPHERS[name](self.value)
+        return self.ciphers[name]
+
+    def wipe(self):
+        self.ciphers.clear()
+        wipe_buffer(self.value)
+
+
+class AgentHandler(socketserver.BaseRequestHandler):
+    """
+    Serves the requests of one client connection
+    """
+    def handle(self):
+        uid = peer_uid(self.request)
+        if uid is not None and uid != os.getuid():
+            return
+
+        while True:
+            try:
+                message = receive_message(self.request)
+            except (EOFError, ConnectionError, AgentError, ValueError):
+                return
+
+            self.server.touch()
+            try:
+                reply = self.server.answer(message)
+            except (AgentError, KeyError, TypeError, ValueError) as e:
+                reply = {"ok": False, "error": str(e) or type(e).__name__}
+
+            stop = message.get("op") == "stop"
+            if stop:
+                # clients connecting once the reply is sent find no agent, rather than one that is exiting
+                self.server.remove_socket()
+            send_message(self.request, reply)
+
+            if stop:
+                threading.Thread(target=self.server.shutdown).start()
+                return
+
+
+class Agent(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str = None, idle_timeout: float = IDLE_TIMEOUT):
+        """
+        :param path: Socket path, default_socket_path() if None
+        :param idle_timeout: Seconds without a request before the agent exits
+        """
+        path = path or default_socket_path()
+        directory = os.path.dirname(path)
+
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        check_directory(directory)
+
+        # a socket left behind by an agent that did not exit cleanly
+        if os.path.exists(path):
+            if connect(path) is not None:
+                raise AgentError(f"An agent is already running at {path}")
+            os.unlink(path)
+
+        super().__init__(path, AgentHandler)
+        os.chmod(path, 0o600)
+
+        self.path = path
+        # tells this agent's socket from one bound at the same path after it was removed
+        self.inode = os.stat(path).st_ino
+        self.idle_timeout = idle_timeout
+        self.keys = {}
+        self.keys_lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.stopped = threading.Event()
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    def key(self, message: dict) -> Key:
+        with self.keys_lock:
+            key = self.keys.get(message["key"])
+        if key is None:
+            raise AgentError("Unknown key")
+        return key
+
+    def answer(self, message: dict) -> dict:
+        op = message.get("op")
+
+        if op == "has":
+            with self.keys_lock:
+                return {"ok": True, "has": message["key"] in self.keys}
+
+        if op == "add":
+            value = decode(message["value"])
+            # the id is the key check of the vault, which also proves the key is the right one
+            if not crypt.compare(crypt.digest(value).hex(), message["key"]):
+                raise AgentError("The key does not match its id")
+
+            key = Key(value)
+            with self.keys_lock:
+                old = self.keys.pop(message["key"], None)
+                self.keys[message["key"]] = key
+            if old is not None:
+                old.wipe()
+            return {"ok": True, "locked": key.locked}
+
+        if op in ("encrypt", "decrypt"):
+            cipher = self.key(message).cipher(message["cipher"])
+            messages = [decode(data) for data in message["messages"]]
+            headers = [decode(data) for data in message["headers"]]
+            if op == "encrypt":
+                results = cipher.encrypt_many(messages, headers)
+            else:
+                results = cipher.decrypt_many(messages, headers, strict=False)
+            return {"ok": True, "messages": [encode(data) for data in results]}
+
+        if op == "subkey":
+            value = crypt.hkdf(self.key(message).value, decode(message["context"]))
+            return {"ok": True, "value": encode(value)}
+
+        if op in ("lock", "stop"):
+            self.forget()
+            return {"ok": True}
+
+        raise AgentError(f"Unknown operation: {op}")
+
+    def forget(self):
+        with self.keys_lock:
+            keys = list(self.keys.values())
+            self.keys.clear()
+        for key in keys:
+            key.wipe()
+
+    def remove_socket(self):
+        """
+        Remove the socket, unless another agent has bound the path since
+        """
+        try:
+            if os.stat(self.path).st_ino == self.inode:
+                os.unlink(self.path)
+        except OSError:
+            pass
+
+    def watch_idle(self):
+        while not self.stopped.wait(1):
+            if time.monotonic() - self.last_used > self.idle_timeout:
+                self.shutdown()
+                return
+
+    def run(self):
+        """
+        Serve until stopped or idle for idle_timeout, then forget every key and remove the socket
+        """
+        protect_process()
+
+        watcher = threading.Thread(target=self.watch_idle, daemon=True)
+        watcher.start()
+        try:
+            self.serve_forever()
+        finally:
+            self.stopped.set()
+            self.forget()
+            self.server_close()
+            self.remove_socket()
+
+
+class AgentClient:
+    """
+    Connection to a running agent
+    """
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.lock = threading.Lock()
+
+    def request(self, message: dict) -> dict:
+        with self.lock:
+            try:
+                send_message(self.sock, message)
+                reply = receive_message(self.sock)
+            except (EOFError, OSError) as e:
+                raise AgentError(f"Lost the connection to the agent: {e}")
+
+        if not reply.get("ok"):
+            raise AgentError(reply.get("error", "Request failed"))
+        return reply
+
+    def has(self, key_id: str) -> bool:
+        return self.request({"op": "has", "key": key_id})["has"]
+
+    def add(self, key_id: str, key: bytes) -> bool:
+        """
+        :return: True if the agent could keep the key out of swap
+        """
+        return self.request({"op": "add", "key": key_id, "value": encode(key)}).get("locked", False)
+
+    def crypt_many(self, op: str, key_id: str, cipher: str, messages: list, headers: list) -> list:
+        results = []
+        for start in range(0, len(messages), REQUEST_BATCH):
+            reply = self.request({
+                "op": op,
+                "key": key_id,
+                "cipher": cipher,
+                "messages": [encode(data) for data in messages[start:start + REQUEST_BATCH]],
+                "headers": [encode(data) for data in headers[start:start + REQUEST_BATCH]],
+            })
+            results += [None if data is None else decode(data) for data in reply["messages"]]
+        return results
+
+    def subkey(self, key_id: str, context: bytes) -> bytes:
+        return decode(self.request({"op": "subkey", "key": key_id, "context": encode(context)})["value"])
+
+    def lock_keys(self):
+        self.request({"op": "lock"})
+
+    def stop(self):
+        self.request({"op": "stop"})
+
+    def close(self):
+        self.sock.close()
+
+
+class AgentCipher(crypt.AEAD):
+    """
+    Cipher whose key stays in the agent, used by vaults in place of the local cipher
+    """
+    def __init__(self, client: AgentClient, key_id: str, name: str):
+        self.client = client
+        self.key_id = key_id
+        self.name = name
+
+    def encrypt(self, plaintext: bytes, header: bytes = b"") -> bytes:
+        return self.encrypt_many([plaintext], [header])[0]
+
+    def decrypt(self, ciphertext: bytes, header: bytes = b"") -> bytes:
+        return self.decrypt_many([ciphertext], [header])[0]
+
+    def encrypt_many(self, plaintexts, headers=None, workers: int = 0) -> list:
+        plaintexts = list(plaintexts)
+        headers = [b""] * len(plaintexts) if headers is None else list(headers)
+        return self.client.crypt_many("encrypt", self.key_id, self.name, plaintexts, headers)
+
+    def decrypt_many(self, ciphertexts, headers=None, workers: int = 0, strict: bool = True) -> list:
+        ciphertexts = list(ciphertexts)
+        headers = [b""] * len(ciphertexts) if headers is None else list(headers)
+        plaintexts = self.client.crypt_many("decrypt", self.key_id, self.name, ciphertexts, headers)
+        if strict and None in plaintexts:
+            raise ValueError("MAC check failed")
+        return plaintexts
+
+    def subkey(self, context: bytes) -> bytes:
+        return self.client.subkey(self.key_id, context)
+
+
+def connect(path: str = None):
+    """
+    :param path: Socket path, default_socket_path() if None
+    :return: AgentClient, None if no agent is listening
+    """
+    path = path or default_socket_path()
+
+    try:
+        check_directory(os.path.dirname(path))
+    except FileNotFoundError:
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+
+    uid = peer_uid(sock)
+    if uid is not None and uid != os.getuid():
+        sock.close()
+        raise AgentError(f"The agent at {path} belongs to another user")
+
+    return AgentClient(sock)
+
+
+def start(path: str = None, idle_timeout: float = IDLE_TIMEOUT) -> AgentClient:
+    """
+    Start an agent in the background unless one is already running
+    :param path: Socket path, default_socket_path() if None
+    :param idle_timeout: Seconds without a request before the agent exits
+    :return: AgentClient connected to it
+    """
+    path = path or default_socket_path()
+
+    client = connect(path)
+    if client is not None:
+        return client
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.Popen(
+        [sys.executable, "-m", "modules.agent", "--socket", path, "--timeout", str(idle_timeout)],
+        cwd=root,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        client = connect(path)
+        if client is not None:
+            return client
+        time.sleep(0.02)
+
+    raise AgentError("The agent did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m modules.agent", description="Run a vault unlock agent in the foreground")
+    parser.add_argument("--socket", help=f"socket path (default ${SOCKET_ENV} or a directory of the user)")
+    parser.add_argument("--timeout", type=float, default=IDLE_TIMEOUT, help=f"idle seconds before exiting (default {IDLE_TIMEOUT})")
+    args = parser.parse_args()
+
+    try:
+        agent = Agent(args.socket, args.timeout)
+    except (AgentError, OSError) as e:
+        parser.exit(1, f"{parser.prog}: {e}\n")
+
+    agent.run()
+
+
+if __name__ == "__main__":
+    main()
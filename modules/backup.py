@@ -0,0 +1,148 @@
+"""
+Streaming encrypted backups of a vault.
+
+A backup is a header followed by chunks. Each chunk is a final-chunk flag,
+a length and a zlib-compressed batch of entries sealed with an AEAD cipher
+under a key derived from the backup password. The header, the chunk number
+and the flag are authenticated with every chunk, so reordered, truncated
+or modified backups are rejected while restoring.
+"""
+
+import json
+import struct
+import zlib
+
+from modules import crypt
+
+MAGIC = b"CBSEBAK1"
+
+# entries sealed per chunk
+CHUNK_ENTRIES = 1000
+
+LENGTH = struct.Struct(">I")
+
+# final flag, sealed length
+CHUNK = struct.Struct(">?I")
+
+# chunk number, final flag
+CHUNK_HEADER = struct.Struct(">Q?")
+
+
+def chunk_header(header: bytes, number: int, final: bool) -> bytes:
+    return crypt.digest(header) + CHUNK_HEADER.pack(number, final)
+
+
+def export(v, file, password: bytes, cipher: str = None, kdf: dict = None):
+    """
+    Write every entry of an unlocked vault to a backup.
+    Entries are streamed from the database, so memory use does not grow with the vault.
+    Raises ValueError if an entry fails to decrypt.
+    Yields (status, done, total).
+    :param v: Unlocked vault.Vault
+    :param file: Binary file object to write to
+    :param password: Backup password
+    :param cipher: Name of a cipher in crypt.CIPHERS (default: that of the vault)
+    :param kdf: Argon2 parameters (default: those of the vault)
+    :return: Number of entries written
+    """
+    cipher = cipher or v.get_cipher()
+    kdf = kdf or v.get_kdf()
+    salt = crypt.generate(128)
+
+    yield ("Deriving key", 0, 0)
+    key = crypt.argon2_derive(password, salt, 32, **kdf)
+    sealer = crypt.CIPHERS[cipher](key)
+    del key
+
+    header = json.dumps({
+        "cipher": cipher,
+        "kdf": kdf,
+        "salt": crypt.encode(salt).decode(),
+    }).encode()
+
+    file.write(MAGIC)
+    file.write(LENGTH.pack(len(header)))
+    file.write(header)
+
+    def write_chunk(number, rows, final):
+        data = zlib.compress(json.dumps(rows).encode())
+        sealed = sealer.encrypt(data, chunk_header(header, number, final))
+        file.write(CHUNK.pack(final, len(sealed)))
+        file.write(sealed)
+
+    total = v.count_entries()
+    done = 0
+    number = 0
+    rows = []
+    # an entry that fails to decrypt aborts the backup rather than being saved as a placeholder
+    for _, title, username, secret in v.iter_entries(strict=True):
+        rows.append([title, username, secret])
+        if len(rows) == CHUNK_ENTRIES:
+            write_chunk(number, rows, False)
+            number += 1
+            done += len(rows)
+            rows = []
+            yield ("Exporting entries", done, total)
+
+    # the final chunk is always written, even if empty, so truncation is detectable
+    write_chunk(number, rows, True)
+    done += len(rows)
+    yield ("Exporting entries", done, total)
+
+    return done
+
+
+def read(file, password: bytes):
+    """
+    Read the entries of a backup, verifying each chunk before yielding from it
+    :param file: Binary file object to read from
+    :param password: Backup password
+    """
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a vault backup")
+
+    header = file.read(LENGTH.unpack(file.read(LENGTH.size))[0])
+    meta = json.loads(header)
+
+    salt = crypt.decode(meta["salt"].encode())
+    key = crypt.argon2_derive(password, salt, 32, **meta["kdf"])
+    opener = crypt.CIPHERS[meta["cipher"]](key)
+    del key
+
+    number = 0
+    while True:
+        prefix = file.read(CHUNK.size)
+        if len(prefix) != CHUNK.size:
+            raise ValueError("Backup is truncated")
+        final, length = CHUNK.unpack(prefix)
+
+        sealed = file.read(length)
+        if len(sealed) != length:
+            raise ValueError("Backup is truncated")
+
+        # a chunk only opens with its own number and its real final flag
+        try:
+            data = opener.decrypt(sealed, chunk_header(header, number, final))
+        except ValueError:
+            raise ValueError("Wrong password or corrupted backup")
+
+        for title, username, secret in json.loads(zlib.decompress(data)):
+            yield (title, username, secret)
+
+        if final:
+            return
+        number += 1
+
+
+def restore(v, file, password: bytes):
+    """
+    Add every entry of a backup to an unlocked vault through the bulk insert path.
+    Nothing is committed unless the whole backup verifies.
+    Yields (status, done, total).
+    :param v: Unlocked vault.Vault
+    :param file: Binary file object to read from
+    :param password: Backup password
+    :return: Number of entries restored
+    """
+    yield ("Deriving key", 0, 0)
+    return (yield from v.add_entries(read(file, password)))
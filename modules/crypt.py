@@ -7,9 +7,21 @@ import time
 import struct
 import base64
 import argon2
-from Crypto.Hash import SHA3_512
-from Crypto.Cipher import AES
+from Crypto.Hash import SHA3_512, SHA256
+from Crypto.Protocol.KDF import HKDF
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from Crypto.Cipher import ChaCha20_Poly1305
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers import aead as cryptography_aead
+
+# messages handed to each worker thread by encrypt_many/decrypt_many
+BATCH_CHUNK = 256
+
+# threads shared by every encrypt_many/decrypt_many call that fans out, see get_pool()
+pool = None
+pool_lock = threading.Lock()
 
 
 def generate(bits: int) -> bytes:
@@ -21,6 +33,18 @@ def generate(bits: int) -> bytes:
     return os.urandom(bits // 8)
 
 
+def get_pool() -> ThreadPoolExecutor:
+    """
+    :return: Thread pool of the batch calls, started on first use
+    """
+    global pool
+
+    with pool_lock:
+        if pool is None:
+            pool = ThreadPoolExecutor(os.cpu_count() or 1, thread_name_prefix="crypt")
+        return pool
+
+
 def encode(data: bytes) -> bytes:
     """
     Encode data in urlsafe base64
@@ -59,30 +83,158 @@ def digest(data: bytes) -> bytes:
     return hasher.digest()
 
 
-def argon2_derive(pw: bytes, salt: bytes, length: int = 32) -> bytes:
+def hkdf(key: bytes, context: bytes, length: int = 32) -> bytes:
+    """
+    Derive an independent subkey from a key with HKDF-SHA256
+    :param key: Input key
+    :param context: Purpose of the subkey
+    :param length: Length of output
+    :return: Derived subkey
+    """
+    return HKDF(key, length, b"", SHA256, context=context)
+
+
+# Argon2 parameters used when a vault does not record its own
+ARGON2_TIME_COST = 3
+ARGON2_MEMORY_COST = 65536
+ARGON2_PARALLELISM = 4
+
+# calibration never goes below this much memory (KiB)
+ARGON2_MIN_MEMORY_COST = 19456
+
+
+def argon2_derive(pw: bytes, salt: bytes, length: int = 32, time_cost: int = ARGON2_TIME_COST,
+                  memory_cost: int = ARGON2_MEMORY_COST, parallelism: int = ARGON2_PARALLELISM) -> bytes:
     """
     Argon2 key derivation (raw)
     :param pw: Password
     :param salt: Salt
     :param length: Length of output
+    :param time_cost: Number of passes
+    :param memory_cost: Memory in KiB
+    :param parallelism: Number of lanes
     :return: Derived key (raw)
     """
     return argon2.low_level.hash_secret_raw(
         secret=pw,
         salt=salt,
-        time_cost=3,
-        memory_cost=65536,
-        parallelism=4,
+        time_cost=time_cost,
+        memory_cost=memory_cost,
+        parallelism=parallelism,
         hash_len=length,
         type=argon2.low_level.Type.ID
     )
 
 
-class AESGCM:
+def argon2_calibrate(target: float = 0.5, memory_cost: int = ARGON2_MEMORY_COST, parallelism: int = None) -> dict:
+    """
+    Benchmark this machine and pick Argon2 parameters for a target derivation time
+    :param target: Target derivation time in seconds
+    :param memory_cost: Starting memory in KiB; halved while a single pass is too slow
+    :param parallelism: Number of lanes (default: all available cores)
+    :return: Keyword arguments for argon2_derive()
+    """
+    parallelism = parallelism or os.cpu_count() or 1
+    salt = generate(128)
+
+    while True:
+        start = time.perf_counter()
+        argon2_derive(b"calibration", salt, 32, 1, memory_cost, parallelism)
+        elapsed = time.perf_counter() - start
+
+        if elapsed <= target or memory_cost // 2 < ARGON2_MIN_MEMORY_COST:
+            break
+        memory_cost //= 2
+
+    # derivation time grows roughly linearly with the number of passes
+    time_cost = max(1, int(target / elapsed))
+
+    return {"time_cost": time_cost, "memory_cost": memory_cost, "parallelism": parallelism}
+
+
+class AEAD(ABC):
+    """
+    Operations shared by the AEAD ciphers. Subclasses implement encrypt() and decrypt().
+    """
+    @abstractmethod
+    def encrypt(self, plaintext: bytes, header: bytes = b"") -> bytes:
+        pass
+
+    @abstractmethod
+    def decrypt(self, ciphertext: bytes, header: bytes = b"") -> bytes:
+        pass
+
+    def encrypt_chunk(self, plaintexts: list, headers: list) -> list:
+        return [self.encrypt(plaintext, header) for plaintext, header in zip(plaintexts, headers)]
+
+    def decrypt_chunk(self, ciphertexts: list, headers: list) -> list:
+        plaintexts = []
+        for ciphertext, header in zip(ciphertexts, headers):
+            try:
+                plaintexts.append(self.decrypt(ciphertext, header))
+            except ValueError:
+                plaintexts.append(None)
+        return plaintexts
+
+    def encrypt_many(self, plaintexts, headers=None, workers: int = 0) -> list:
+        """
+        Encrypt many messages, each with its own nonce
+        :param plaintexts: Sequence of plaintexts (bytes, bytearray or memoryview)
+        :param headers: Sequence of additional authenticated data, one per message (optional)
+        :param workers: Threads to spread the messages over; 0 encrypts on the calling thread
+        :return: List of ciphertexts, each the same as encrypt() would return
+        """
+        return self.map(self.encrypt_chunk, plaintexts, headers, workers)
+
+    def decrypt_many(self, ciphertexts, headers=None, workers: int = 0, strict: bool = True) -> list:
+        """
+        Decrypt many messages
+        :param ciphertexts: Sequence of ciphertexts (bytes, bytearray or memoryview)
+        :param headers: Sequence of additional authenticated data, one per message (optional)
+        :param workers: Threads to spread the messages over; 0 decrypts on the calling thread
+        :param strict: Raise ValueError if any message fails to verify, instead of returning None for it
+        :return: List of plaintexts
+        """
+        plaintexts = self.map(self.decrypt_chunk, ciphertexts, headers, workers)
+        if strict and None in plaintexts:
+            raise ValueError("MAC check failed")
+        return plaintexts
+
+    def subkey(self, context: bytes) -> bytes:
+        """
+        Derive a key for a purpose other than this cipher from its key
+        :param context: Purpose of the key
+        :return: 256 bit subkey
+        """
+        return hkdf(self.key, context)
+
+    def map(self, function, messages, headers, workers: int) -> list:
+        messages = list(messages)
+        headers = [b""] * len(messages) if headers is None else list(headers)
+        if len(headers) != len(messages):
+            raise ValueError("Expected one header per message")
+        if not messages:
+            return []
+
+        if workers <= 1 or len(messages) <= BATCH_CHUNK:
+            return function(messages, headers)
+
+        # one chunk per worker, of at least BATCH_CHUNK messages
+        size = max(BATCH_CHUNK, -(-len(messages) // workers))
+        chunks = [
+            get_pool().submit(function, messages[start:start + size], headers[start:start + size])
+            for start in range(0, len(messages), size)
+        ]
+        return [result for chunk in chunks for result in chunk.result()]
+
+
+class AESGCM(AEAD):
     def __init__(self, key: bytes):
         if len(key) != 32:
             raise ValueError("Incorrect key length for AES")
         self.key = key
+        # keeps the AES key schedule and GHASH key for every message of this key
+        self.context = cryptography_aead.AESGCM(key)
 
     @classmethod
     def generate_key(cls, bits: int = 256) -> bytes:
@@ -102,12 +254,9 @@ class AESGCM:
         :param header: Additional authenticated but unencrypted data (optional)
         :return: Encrypted ciphertext
         """
-        cipher = AES.new(self.key, AES.MODE_GCM)
-        if header is not None:
-            cipher.update(header)
-        ciphertext, tag = cipher.encrypt_and_digest(plaintext)
-        ciphertext = cipher.nonce + ciphertext + tag
-        return ciphertext
+        # 128 bit nonces, as pycryptodome generated for the vaults sealed before
+        nonce = generate(128)
+        return nonce + self.context.encrypt(nonce, plaintext, header)
 
     def decrypt(self, ciphertext: bytes, header: bytes = b"") -> bytes:
         """
@@ -116,15 +265,14 @@ class AESGCM:
         :param header: Additional authenticated but unencrypted data (optional)
         :return: Decrypted plaintext
         """
-        nonce, ciphertext, tag = ciphertext[:16], ciphertext[16:-16], ciphertext[-16:]
-        cipher = AES.new(self.key, AES.MODE_GCM, nonce)
-        if header is not None:
-            cipher.update(header)
-        plaintext = cipher.decrypt_and_verify(ciphertext, tag)
-        return plaintext
+        ciphertext = memoryview(ciphertext)
+        try:
+            return self.context.decrypt(ciphertext[:16], ciphertext[16:], header)
+        except InvalidTag:
+            raise ValueError("MAC check failed")
 
 
-class XChaCha20Poly1305:
+class XChaCha20Poly1305(AEAD):
     def __init__(self, key: bytes):
         if len(key) != 32:
             raise ValueError("Incorrect key length for XChaCha20Poly1305")
@@ -160,6 +308,7 @@ class XChaCha20Poly1305:
         :param header: Additional authenticated but unencrypted data (optional)
         :return: Decrypted plaintext
         """
+        ciphertext = memoryview(ciphertext)
         nonce, ciphertext, tag = ciphertext[:24], ciphertext[24:-16], ciphertext[-16:]
         cipher = ChaCha20_Poly1305.new(key=self.key, nonce=nonce)
         if header is not None:
@@ -168,6 +317,46 @@ class XChaCha20Poly1305:
         return plaintext
 
 
+# AEAD ciphers by the name stored alongside data encrypted with them
+CIPHERS = {
+    "aes-gcm": AESGCM,
+    "xchacha20-poly1305": XChaCha20Poly1305,
+}
+
+DEFAULT_CIPHER = "aes-gcm"
+
+
+def benchmark_ciphers(count: int = 200, size: int = 96) -> dict:
+    """
+    Time sealing and opening a batch of vault-sized records with every cipher
+    :param count: Number of records
+    :param size: Size of each record in bytes
+    :return: dict of cipher name -> seconds
+    """
+    messages = [generate(size * 8) for _ in range(count)]
+    headers = [struct.pack(">Q", i) for i in range(count)]
+
+    timings = {}
+    for name, cipher_class in CIPHERS.items():
+        cipher = cipher_class(generate(256))
+        # warm up, so one-time setup such as loading the C extensions is not timed
+        cipher.decrypt_many(cipher.encrypt_many(messages[:1], headers[:1]), headers[:1])
+
+        start = time.perf_counter()
+        cipher.decrypt_many(cipher.encrypt_many(messages, headers), headers)
+        timings[name] = time.perf_counter() - start
+
+    return timings
+
+
+def recommend_cipher() -> str:
+    """
+    :return: Name of the fastest cipher in CIPHERS on this machine
+    """
+    timings = benchmark_ciphers()
+    return min(timings, key=timings.get)
+
+
 class OTP:
     def __init__(self, key: str, digits: int = 6, digest: str = "sha1"):
         self.key = key
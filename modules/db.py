@@ -0,0 +1,120 @@
+"""
+SQLite connection layer for vaults:
+- connect(): open a database in WAL mode with tuned pragmas
+- get_schema_version(), create_schema(): schema versions stored in meta
+- transaction(): explicit write transactions that nest by joining the outer one
+"""
+
+import os
+import sqlite3
+from contextlib import contextmanager
+
+# applied in order on every connection
+PRAGMAS = (
+    # only takes effect while the database is still empty
+    ("page_size", 4096),
+    # readers never block the writer and commits append to the log instead of rewriting pages
+    ("journal_mode", "WAL"),
+    # in WAL mode NORMAL only syncs at checkpoints; a crash cannot corrupt the database
+    ("synchronous", "NORMAL"),
+    # negative values are KiB
+    ("cache_size", -16384),
+    ("mmap_size", 1 << 28),
+    ("temp_store", "MEMORY"),
+)
+
+
+def connect(path: os.PathLike) -> sqlite3.Connection:
+    """
+    Open a database with the vault's pragmas.
+    The connection is in autocommit mode; writes are grouped with transaction().
+    :param path: Path of the database file
+    :return: sqlite3 connection
+    """
+    # the connection is handed between the GUI and worker threads,
+    # but never used by both at once
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    for name, value in PRAGMAS:
+        conn.execute(f"PRAGMA {name}={value}")
+
+    return conn
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """
+    :param conn: sqlite3 connection
+    :return: Schema version stored in meta, 0 for a database without tables
+    """
+    try:
+        row = conn.execute("SELECT v FROM meta WHERE k='schema_version'").fetchone()
+    except sqlite3.OperationalError:
+        # no meta table in a new database
+        return 0
+
+    # vaults from before the version was stored are at version 1
+    return int(row[0]) if row is not None else 1
+
+
+def set_schema_version(conn: sqlite3.Connection, version: int):
+    conn.execute("INSERT OR REPLACE INTO meta (k, v) VALUES ('schema_version', ?)", (str(version), ))
+
+
+def create_schema(conn: sqlite3.Connection, schema: str, version: int):
+    """
+    Create the tables of a new database and record their schema version
+    :param conn: sqlite3 connection
+    :param schema: SQL script creating the tables
+    :param version: Version of the schema
+    """
+    # executescript commits on its own, so it cannot share the transaction
+    conn.executescript(schema)
+    with transaction(conn):
+        set_schema_version(conn, version)
+
+
+def columns(conn: sqlite3.Connection, table: str) -> list:
+    """
+    :param conn: sqlite3 connection
+    :param table: Table name
+    :return: Names of the columns of table
+    """
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+@contextmanager
+def transaction(conn: sqlite3.Connection):
+    """
+    Run the enclosed writes in one transaction, committed on exit and rolled back
+    on any exception, including GeneratorExit when a generator is closed early
+    and a failing COMMIT.
+    Inside another transaction it joins the outer one, so callers can batch many
+    single-row writes into one commit.
+    :param conn: sqlite3 connection in autocommit mode
+    """
+    if conn.in_transaction:
+        yield conn
+        return
+
+    # take the write lock up front rather than failing to upgrade a read lock later
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+    try:
+        conn.execute("COMMIT")
+    except BaseException:
+        # a failed COMMIT can leave the transaction open, and every later
+        # transaction() would join it and never commit
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+
+
+def optimize(conn: sqlite3.Connection):
+    """
+    Let SQLite refresh query planner statistics it considers stale; cheap enough for every close
+    """
+    conn.execute("PRAGMA optimize")
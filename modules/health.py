@@ -0,0 +1,151 @@
+"""
+Password health report over a whole vault:
+- check(): stream per-entry strength, breach, reuse and similarity results
+- describe(): the problems of one result, as shown to the user
+"""
+
+import queue
+import threading
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from modules import pwquality, similarity
+
+# similar is the number of the group of near-duplicate passwords, -1 if none
+Result = namedtuple(
+    "Result",
+    ["entry_id", "title", "username", "score", "breaches", "reused", "similar", "fingerprint"],
+)
+
+# breaches of a result whose breach lookup has not finished; -1 means it failed
+BREACHES_PENDING = -2
+
+
+def is_problem(result: Result) -> bool:
+    """
+    :param result: Health check result
+    :return: True if the entry is weak, breached, reused or similar to another
+    """
+    return result.score < 3 or result.breaches > 0 or result.reused > 0 or result.similar >= 0
+
+
+def describe(result: Result) -> list:
+    """
+    :param result: Health check result
+    :return: One description per problem of the entry, empty if it has none
+    """
+    problems = []
+    if result.score < 3:
+        problems.append(f"score: {result.score}")
+    if result.breaches > 0:
+        problems.append(f"exposed {result.breaches} times in data breaches")
+    if result.reused > 0:
+        problems.append(f"reused by {result.reused} other entries")
+    if result.similar >= 0:
+        problems.append(f"similar to other passwords (group {result.similar + 1})")
+    return problems
+
+
+def check(entries, cache: pwquality.ScoreCache, previous: dict = None, hibp_cache=None):
+    """
+    Check every entry, yielding a Result as soon as it is known.
+    Entries whose password is unchanged since the previous report are yielded first
+    without being checked again, unless their breach lookup failed; the rest are
+    scored and looked up concurrently. Their results are yielded once scored, with
+    breaches BREACHES_PENDING until the range of the password arrives, then again.
+    The last Result yielded for an entry is final.
+    :param entries: Iterable of (entry_id, title, username, password) tuples, read once when
+                    the check starts, so Vault.iter_entries() decrypts on the checking thread
+    :param cache: ScoreCache, also used to fingerprint passwords
+    :param previous: dict of entry_id -> Result from the last report (optional)
+    :param hibp_cache: hibpcache.RangeCache for breach lookups (optional)
+    """
+    previous = previous or {}
+    entries = list(entries)
+
+    # exact reuse in O(N) through the password fingerprints
+    fingerprints = [cache.fingerprint(password) for *_, password in entries]
+    reuse = Counter(fingerprints)
+
+    # near-duplicates through MinHash/LSH rather than pairwise comparison
+    groups = {}
+    passwords = [password for *_, password in entries]
+    for group, positions in enumerate(similarity.similar_groups(passwords)):
+        for i in positions:
+            groups[entries[i][0]] = group
+
+    changed = []
+    for (entry_id, title, username, password), fingerprint in zip(entries, fingerprints):
+        old = previous.get(entry_id)
+        # results whose breach lookup failed or never finished are checked again
+        if old is not None and old.fingerprint == fingerprint and old.breaches >= 0:
+            yield old._replace(
+                title=title,
+                username=username,
+                reused=reuse[fingerprint] - 1,
+                similar=groups.get(entry_id, -1),
+            )
+        else:
+            changed.append((entry_id, title, username, password, fingerprint))
+
+    # only the passwords still to be checked are kept from here on
+    del entries, passwords
+
+    if not changed:
+        return
+
+    def result(i: int, score: int, breaches: int) -> Result:
+        entry_id, title, username, _, fingerprint = changed[i]
+        return Result(
+            entry_id,
+            title,
+            username,
+            score,
+            breaches,
+            reuse[fingerprint] - 1,
+            groups.get(entry_id, -1),
+            fingerprint,
+        )
+
+    passwords = [password for _, _, _, password, _ in changed]
+
+    # scoring and breach lookups each run on a thread of their own and hand over
+    # (kind, position, value) as values arrive; (kind, None, None) ends a stream
+    arrived = queue.SimpleQueue()
+    stop = threading.Event()
+
+    def feed(kind: int, values):
+        try:
+            for i, value in values:
+                if stop.is_set():
+                    break
+                arrived.put((kind, i, value))
+        finally:
+            values.close()
+            arrived.put((kind, None, None))
+
+    scores = {}
+    counts = {}
+    pool = ThreadPoolExecutor(2)
+    try:
+        feeds = [
+            pool.submit(feed, 0, pwquality.pwquality_many(passwords, cache=cache)),
+            pool.submit(feed, 1, pwquality.check_pwned_iter(passwords, cache=hibp_cache)),
+        ]
+
+        running = len(feeds)
+        while running:
+            kind, i, value = arrived.get()
+            if i is None:
+                running -= 1
+                # raises what ended the stream, if it failed
+                feeds[kind].result()
+                continue
+
+            (scores, counts)[kind][i] = value
+            # a score is shown at once and shown again when its breach count arrives
+            if i in scores:
+                yield result(i, scores[i], counts.get(i, BREACHES_PENDING))
+    finally:
+        stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
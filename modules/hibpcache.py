@@ -0,0 +1,172 @@
+"""
+On-disk cache of HaveIBeenPwned range responses.
+Each range is stored as one file of sorted fixed-width records,
+so a lookup is a binary search instead of a scan of the response text.
+"""
+
+import os
+import struct
+import time
+
+MAGIC = b"HIBPRNG1"
+
+# magic, fetch time, etag length
+HEADER = struct.Struct("<8sdH")
+
+# 35 hex char suffix packed into 18 bytes, breach count
+RECORD = struct.Struct(">18sI")
+
+# ranges younger than this are used without asking the API
+DEFAULT_TTL = 7 * 24 * 60 * 60
+
+# ranges older than this are evicted
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+
+DEFAULT_MAX_ENTRIES = 4096
+
+
+def pack_suffix(suffix: str) -> bytes:
+    """
+    Pack a 35 hex char hash suffix into 18 bytes
+    :param suffix: Hash suffix
+    :return: Packed suffix
+    """
+    return bytes.fromhex("0" + suffix)
+
+
+class Range:
+    def __init__(self, records: bytes, etag: str = "", fetched: float = None):
+        self.records = records
+        self.etag = etag
+        self.fetched = time.time() if fetched is None else fetched
+
+    @classmethod
+    def from_counts(cls, counts: dict, etag: str = "") -> "Range":
+        """
+        Build a range from a parsed API response
+        :param counts: dict of suffix -> count
+        :param etag: ETag of the response
+        :return: Range
+        """
+        records = b"".join(
+            RECORD.pack(pack_suffix(suffix), count)
+            for suffix, count in sorted(counts.items())
+        )
+        return cls(records, etag)
+
+    def get(self, suffix: str, default: int = 0) -> int:
+        """
+        Binary search for a hash suffix
+        :param suffix: 35 hex char suffix, upper case
+        :param default: Value returned if the suffix is absent
+        :return: Breach count
+        """
+        key = pack_suffix(suffix)
+        size = RECORD.size
+
+        lo, hi = 0, len(self.records) // size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.records[mid * size:mid * size + 18] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        offset = lo * size
+        if self.records[offset:offset + 18] == key:
+            return RECORD.unpack_from(self.records, offset)[1]
+        return default
+
+    def dumps(self) -> bytes:
+        etag = self.etag.encode()
+        return HEADER.pack(MAGIC, self.fetched, len(etag)) + etag + self.records
+
+    @classmethod
+    def loads(cls, data: bytes) -> "Range":
+        magic, fetched, etag_len = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a cached range")
+
+        start = HEADER.size + etag_len
+        etag = data[HEADER.size:start].decode()
+        records = data[start:]
+        if len(records) % RECORD.size:
+            raise ValueError("Truncated cached range")
+
+        return cls(records, etag, fetched)
+
+
+class RangeCache:
+    def __init__(self, directory: os.PathLike, ttl: float = DEFAULT_TTL,
+                 max_age: float = DEFAULT_MAX_AGE, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_age = max_age
+        self.max_entries = max_entries
+
+    def path(self, prefix: str) -> str:
+        return os.path.join(self.directory, prefix + ".bin")
+
+    def get(self, prefix: str):
+        """
+        Read a cached range, fresh or stale
+        :param prefix: 5 char SHA1 prefix
+        :return: Range, None if not cached
+        """
+        try:
+            with open(self.path(prefix), "rb") as file:
+                return Range.loads(file.read())
+        except (OSError, ValueError, struct.error):
+            return None
+
+    def is_fresh(self, rng: Range) -> bool:
+        return time.time() - rng.fetched < self.ttl
+
+    def put(self, prefix: str, rng: Range):
+        """
+        Store a range, replacing the file atomically
+        :param prefix: 5 char SHA1 prefix
+        :param rng: Range to store
+        """
+        os.makedirs(self.directory, exist_ok=True)
+
+        path = self.path(prefix)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as file:
+            file.write(rng.dumps())
+        os.replace(tmp, path)
+
+    def touch(self, prefix: str, rng: Range):
+        """
+        Mark a range as fresh again after the API confirmed it unchanged
+        :param prefix: 5 char SHA1 prefix
+        :param rng: Range to refresh
+        """
+        rng.fetched = time.time()
+        self.put(prefix, rng)
+
+    def evict(self):
+        """
+        Remove ranges older than max_age, then the oldest ones beyond max_entries
+        """
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith(".bin")]
+        except OSError:
+            return
+
+        now = time.time()
+        files = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                files.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+
+        files.sort(reverse=True)
+        for i, (mtime, path) in enumerate(files):
+            if i >= self.max_entries or now - mtime > self.max_age:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
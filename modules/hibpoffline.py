@@ -0,0 +1,161 @@
+"""
+Offline HaveIBeenPwned lookups against a local Pwned Passwords dataset.
+
+The downloadable SHA1 dump (ordered by hash, "HASH:COUNT" per line) is
+imported once into a compact binary file:
+- header: magic, record count
+- bucket index: start record of every 2-byte hash prefix
+- records: remaining 18 hash bytes and a 4-byte count, sorted
+
+Lookups memory-map the file and binary search a single bucket,
+so the dataset is never loaded into RAM.
+"""
+
+import hashlib
+import mmap
+import struct
+import sys
+
+MAGIC = b"HIBPOFF1"
+
+HEADER = struct.Struct("<8sQ")
+
+BUCKETS = 1 << 16
+INDEX = struct.Struct(f"<{BUCKETS + 1}Q")
+
+# hash without its 2-byte bucket prefix, breach count
+RECORD = struct.Struct(">18sI")
+
+# dump lines read between progress reports
+PROGRESS_INTERVAL = 1_000_000
+
+
+def import_dump(src: str, dst: str):
+    """
+    Convert a Pwned Passwords SHA1 dump into the offline format.
+    Yields the number of records written so far.
+    :param src: Path of the dump, ordered by hash
+    :param dst: Path of the output file
+    """
+    starts = [0] * (BUCKETS + 1)
+    count = 0
+    previous = b""
+
+    with open(src, "rb") as infile, open(dst, "wb") as outfile:
+        # the index is written once all buckets are known
+        outfile.write(HEADER.pack(MAGIC, 0))
+        outfile.write(INDEX.pack(*starts))
+
+        for line in infile:
+            line = line.strip()
+            if not line:
+                continue
+
+            digest, _, times = line.partition(b":")
+            if len(digest) != 40:
+                raise ValueError("Not a SHA1 Pwned Passwords dump")
+
+            raw = bytes.fromhex(digest.decode())
+            if raw <= previous:
+                raise ValueError("Dump must be ordered by hash")
+            previous = raw
+
+            starts[int.from_bytes(raw[:2], "big") + 1] += 1
+            outfile.write(RECORD.pack(raw[2:], min(int(times), 0xFFFFFFFF)))
+
+            count += 1
+            if count % PROGRESS_INTERVAL == 0:
+                yield count
+
+        # bucket sizes -> start offsets
+        for bucket in range(BUCKETS):
+            starts[bucket + 1] += starts[bucket]
+
+        outfile.seek(0)
+        outfile.write(HEADER.pack(MAGIC, count))
+        outfile.write(INDEX.pack(*starts))
+
+    yield count
+
+
+class OfflineDataset:
+    def __init__(self, path: str):
+        self.file = open(path, "rb")
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files cannot be mapped
+            self.file.close()
+            raise ValueError("Not an offline Pwned Passwords dataset")
+
+        try:
+            magic, self.count = HEADER.unpack_from(self.map)
+            self.starts = INDEX.unpack_from(self.map, HEADER.size)
+        except struct.error:
+            # too short for the header and index
+            magic = None
+
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("Not an offline Pwned Passwords dataset")
+
+        self.records = HEADER.size + INDEX.size
+
+    def lookup(self, digest: bytes) -> int:
+        """
+        Look up a raw SHA1 digest
+        :param digest: 20 byte SHA1 digest
+        :return: number of times seen in breaches
+        """
+        bucket = int.from_bytes(digest[:2], "big")
+        key = digest[2:]
+        size = RECORD.size
+
+        lo, hi = self.starts[bucket], self.starts[bucket + 1]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = self.records + mid * size
+            if self.map[offset:offset + 18] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        offset = self.records + lo * size
+        if lo < self.starts[bucket + 1] and self.map[offset:offset + 18] == key:
+            return RECORD.unpack_from(self.map, offset)[1]
+        return 0
+
+    def check(self, password: str) -> int:
+        """
+        Check a password against the dataset
+        :param password: Password to check
+        :return: number of times seen in breaches
+        """
+        return self.lookup(hashlib.sha1(password.encode("utf-8")).digest())
+
+    def check_many(self, passwords) -> list:
+        """
+        Check many passwords, visiting the file in hash order
+        :param passwords: Passwords to check
+        :return: number of times each password was seen in breaches
+        """
+        digests = [hashlib.sha1(password.encode("utf-8")).digest() for password in passwords]
+
+        counts = [0] * len(digests)
+        for i in sorted(range(len(digests)), key=digests.__getitem__):
+            counts[i] = self.lookup(digests[i])
+
+        return counts
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print(f"usage: {sys.argv[0]} <pwned-passwords-sha1-ordered-by-hash.txt> <output>")
+        sys.exit(1)
+
+    for written in import_dump(sys.argv[1], sys.argv[2]):
+        print(f"{written} hashes imported")
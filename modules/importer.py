@@ -0,0 +1,170 @@
+"""
+Stream entries out of other password managers' exports:
+- read_csv(): Bitwarden, KeePass or plain title/username/password CSV
+- read_json(): Bitwarden JSON or a list of title/username/password objects
+Both yield (title, username, password) without loading the whole file.
+"""
+
+import csv
+import json
+
+# accepted column names, lower case, for each field
+CSV_COLUMNS = {
+    "title": ("title", "name", "account"),
+    "username": ("username", "login_username", "user name", "login name", "login"),
+    "password": ("password", "login_password"),
+}
+
+# bitwarden's column of the item type; only its logins hold credentials, as in read_json
+CSV_TYPE_COLUMN = "type"
+CSV_LOGIN_TYPE = "login"
+
+# bytes read at a time while streaming JSON
+CHUNK_SIZE = 1 << 16
+
+
+def read_csv(file):
+    """
+    Read entries from a CSV export
+    :param file: Text file object
+    """
+    reader = csv.reader(file)
+    header = [name.strip().lower() for name in next(reader, [])]
+
+    columns = {}
+    for field, names in CSV_COLUMNS.items():
+        for name in names:
+            if name in header:
+                columns[field] = header.index(name)
+                break
+        else:
+            raise ValueError(f"No {field} column in CSV header")
+
+    kind = header.index(CSV_TYPE_COLUMN) if CSV_TYPE_COLUMN in header else None
+
+    for row in reader:
+        # notes and cards have a name but no login
+        if kind is not None and kind < len(row) and row[kind].strip().lower() not in ("", CSV_LOGIN_TYPE):
+            continue
+
+        title, username, password = (
+            row[columns[field]] if columns[field] < len(row) else ""
+            for field in ("title", "username", "password")
+        )
+        if title or password:
+            yield (title, username, password)
+
+
+def read_json(file):
+    """
+    Read entries from a Bitwarden JSON export ({"items": [...]})
+    or a JSON list of {"title", "username", "password"} objects
+    :param file: Text file object
+    """
+    for item in JSONStream(file).items("items"):
+        if not isinstance(item, dict):
+            continue
+
+        # bitwarden keeps credentials under "login"; notes and cards have none
+        login = item.get("login")
+        if isinstance(login, dict):
+            yield (item.get("name") or "", login.get("username") or "", login.get("password") or "")
+        elif "password" in item:
+            yield (item.get("title") or item.get("name") or "", item.get("username") or "", item["password"] or "")
+
+
+class JSONStream:
+    """
+    Incremental reader for the elements of one JSON array,
+    either the top level value or a member of the top level object.
+    Only one element at a time is held in memory.
+    """
+    def __init__(self, file):
+        self.file = file
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self) -> bool:
+        if self.eof:
+            return False
+
+        chunk = self.file.read(CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON")
+
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+        if char not in chars:
+            raise ValueError(f"Expected one of {chars!r} in JSON, got {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # the value may continue in the next chunk
+                if not self.fill():
+                    raise
+                continue
+
+            # a number could still continue in the next chunk
+            if end == len(self.buffer) and not self.eof and self.fill():
+                continue
+
+            self.pos = end
+            return value
+
+    def elements(self):
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                return
+
+    def items(self, key: str):
+        """
+        Yield the elements of the top level array, or of the array under key
+        :param key: Member of the top level object holding the array
+        """
+        if self.peek() == "[":
+            yield from self.elements()
+            return
+
+        self.expect("{")
+        if self.peek() == "}":
+            return
+
+        while True:
+            name = self.value()
+            self.expect(":")
+            if name == key:
+                yield from self.elements()
+                return
+
+            # other members (folders, collections) are small and skipped
+            self.value()
+            if self.expect(",}") == "}":
+                return
@@ -0,0 +1,187 @@
+"""
+Upgrade vault databases from older schema versions.
+
+MIGRATIONS lists the steps in order, each bringing the schema up one version.
+Steps are generators yielding (status, done, total). Rows are rewritten through
+batched(), which commits each batch together with the last id it reached, so:
+- no more than one batch of rows is held in memory,
+- other readers are never locked out for the whole upgrade,
+- an interrupted upgrade resumes where it stopped instead of starting over.
+A step must therefore be safe to run again on a partly upgraded database.
+"""
+
+import time
+
+from modules import db
+
+# rows rewritten per transaction
+BATCH_SIZE = 500
+
+
+def progress_key(version: int) -> str:
+    return f"migration:{version}"
+
+
+def batched(v, version: int, status: str, select: str, update):
+    """
+    Rewrite entries in id order, one transaction per batch.
+    Yields (status, done, total).
+    :param v: Open vault.Vault
+    :param version: Version the running step upgrades to, used to resume it
+    :param status: Progress message
+    :param select: Query selecting rows with id as the first column,
+                   taking the last id seen and a batch size: "... WHERE id > ? ORDER BY id LIMIT ?"
+    :param update: Function called with the cursor and the selected rows of each batch
+    """
+    conn = v.conn
+    key = progress_key(version)
+
+    row = conn.execute("SELECT v FROM meta WHERE k=?", (key, )).fetchone()
+    last_id = int(row[0]) if row is not None else 0
+
+    total = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+    done = conn.execute("SELECT COUNT(*) FROM entries WHERE id <= ?", (last_id, )).fetchone()[0]
+
+    while True:
+        yield (status, done, total)
+
+        with db.transaction(conn):
+            cur = conn.cursor()
+            rows = cur.execute(select, (last_id, BATCH_SIZE)).fetchall()
+            if not rows:
+                break
+
+            update(cur, rows)
+
+            last_id = rows[-1][0]
+            cur.execute("INSERT OR REPLACE INTO meta (k, v) VALUES (?, ?)", (key, str(last_id)))
+
+        done += len(rows)
+
+
+def add_timestamps(v):
+    """
+    Version 2: created and modified times of entries, in seconds since the epoch.
+    Existing entries get the time of the upgrade.
+    """
+    with db.transaction(v.conn):
+        existing = db.columns(v.conn, "entries")
+        for column in ("created", "modified"):
+            if column not in existing:
+                # adding a nullable column without a default does not rewrite the table
+                v.conn.execute(f"ALTER TABLE entries ADD COLUMN {column} INTEGER")
+
+    now = int(time.time())
+
+    def update(cur, rows):
+        cur.executemany(
+            "UPDATE entries SET created=?, modified=? WHERE id=?",
+            ((now, now, entry_id) for entry_id, in rows),
+        )
+
+    yield from batched(
+        v,
+        2,
+        "Adding entry timestamps",
+        "SELECT id FROM entries WHERE id > ? AND created IS NULL ORDER BY id LIMIT ?",
+        update,
+    )
+
+
+def pack_records(v):
+    """
+    Version 3: the fields of each entry sealed together in one record, authenticated
+    with the row id, instead of three separately encrypted columns.
+    Rows are copied into a new table, which replaces the old one once complete.
+    """
+    assert v.cipher is not None
+
+    # the tables were already swapped when the version was about to be recorded
+    if "record" in db.columns(v.conn, "entries"):
+        return
+
+    with db.transaction(v.conn):
+        v.conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries_packed (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                record BLOB NOT NULL,
+                created INTEGER,
+                modified INTEGER
+            )
+        """)
+
+    def update(cur, rows):
+        # unreadable fields stay marked as such
+        fields = v.decrypt_fields([field for row in rows for field in row[1:4]])
+        records = v.encrypt_records([
+            (entry_id, *fields[3 * i:3 * i + 3]) for i, (entry_id, *_) in enumerate(rows)
+        ])
+        values = [
+            (entry_id, record, created, modified)
+            for (entry_id, *_, created, modified), record in zip(rows, records)
+        ]
+
+        cur.executemany(
+            "INSERT OR REPLACE INTO entries_packed (id, record, created, modified) VALUES (?, ?, ?, ?)",
+            values,
+        )
+
+    yield from batched(
+        v,
+        3,
+        "Packing entries",
+        "SELECT id, title, username, password, created, modified FROM entries WHERE id > ? ORDER BY id LIMIT ?",
+        update,
+    )
+
+    yield ("Packing entries", 0, 0)
+    with db.transaction(v.conn):
+        cur = v.conn.cursor()
+
+        # deleted ids must not be handed out again
+        row = cur.execute("SELECT seq FROM sqlite_sequence WHERE name='entries'").fetchone()
+        seq = row[0] if row else 0
+
+        cur.execute("DROP TABLE entries")
+        cur.execute("ALTER TABLE entries_packed RENAME TO entries")
+        cur.execute("DELETE FROM sqlite_sequence WHERE name='entries'")
+        cur.execute(
+            "INSERT INTO sqlite_sequence (name, seq) VALUES ('entries', MAX(?, (SELECT IFNULL(MAX(id), 0) FROM entries)))",
+            (seq, ),
+        )
+
+
+# (version reached, step), in order
+MIGRATIONS = [
+    (2, add_timestamps),
+    (3, pack_records),
+]
+
+
+def pending(v, target: int) -> list:
+    """
+    :param v: Open vault.Vault
+    :param target: Schema version to upgrade to
+    :return: Versions still to be reached
+    """
+    current = db.get_schema_version(v.conn)
+    return [version for version, _ in MIGRATIONS if current < version <= target]
+
+
+def migrate(v, target: int):
+    """
+    Run every step between the schema version of a vault and target.
+    Yields (status, done, total).
+    :param v: Open vault.Vault, unlocked if a step re-encrypts entries
+    :param target: Schema version to upgrade to
+    """
+    versions = pending(v, target)
+    for version, step in MIGRATIONS:
+        if version not in versions:
+            continue
+
+        yield from step(v)
+
+        with db.transaction(v.conn):
+            db.set_schema_version(v.conn, version)
+            v.conn.execute("DELETE FROM meta WHERE k=?", (progress_key(version), ))
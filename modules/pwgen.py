@@ -3,16 +3,140 @@ Generate reliably secure passwords and passphrases
 """
 
 import os
+import math
+import argparse
+import sys
+import mmap
 import string
-import secrets
+import struct
+from array import array
+from functools import lru_cache
+from itertools import accumulate, islice
 
-WORDS_LIST_FILE = os.path.join("data", "words_alpha.txt")
+from modules.pwpolicy import CLASSES, Policy
 
-with open(WORDS_LIST_FILE, "r") as file:
-    WORDS_LIST = [x for x in file.read().split() if len(x) >= 5]
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
 
+WORDS_LIST_FILE = os.path.join(DATA_DIR, "words_alpha.txt")
 
-def generate_password(uppercase: bool = True, lowercase: bool = True, digits: bool = True, symbols: bool = True, length: int = 24):
+# WORDS_LIST_FILE compiled for lookups without loading it, rebuilt whenever the text file is newer:
+# - header: magic, word count
+# - offsets: count + 1 little endian uint32 positions in the word buffer
+# - words: every word, ASCII, concatenated
+WORDS_PACKED_FILE = os.path.join(DATA_DIR, "words_alpha.bin")
+
+WORDS_MAGIC = b"PWWORDS1"
+WORDS_HEADER = struct.Struct("<8sI")
+WORDS_OFFSET = struct.Struct("<I")
+# start and end of one word
+WORDS_SPAN = struct.Struct("<2I")
+
+# shortest word used in passphrases
+WORDS_MIN_LENGTH = 5
+
+# most random bytes read from the OS at once
+RANDOM_BLOCK = 1 << 16
+
+# passwords written per write by the command line
+OUTPUT_CHUNK = 1024
+
+
+class Wordlist:
+    """
+    Read-only view of a packed wordlist. Words are decoded one at a time
+    when selected, so the list costs no Python objects per word.
+    """
+    def __init__(self, data):
+        magic, self.count = WORDS_HEADER.unpack_from(data)
+        if magic != WORDS_MAGIC:
+            raise ValueError("Not a packed wordlist")
+
+        self.data = data
+        self.offsets = WORDS_HEADER.size
+        self.words = self.offsets + (self.count + 1) * WORDS_OFFSET.size
+
+    @classmethod
+    def open(cls, path: str):
+        with open(path, "rb") as file:
+            return cls(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i: int) -> str:
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+
+        start, end = WORDS_SPAN.unpack_from(self.data, self.offsets + i * WORDS_OFFSET.size)
+        return self.data[self.words + start:self.words + end].decode("ascii")
+
+
+def pack_words(src: str) -> bytes:
+    """
+    Compile a text wordlist into the packed format
+    :param src: Path of the text wordlist, whitespace separated
+    :return: Packed wordlist
+    """
+    with open(src, "rb") as file:
+        words = [word for word in file.read().split() if len(word) >= WORDS_MIN_LENGTH and word.isascii()]
+
+    offsets = array("I", accumulate((len(word) for word in words), initial=0))
+    if sys.byteorder == "big":
+        offsets.byteswap()
+
+    return b"".join((
+        WORDS_HEADER.pack(WORDS_MAGIC, len(words)),
+        offsets.tobytes(),
+        b"".join(words),
+    ))
+
+
+def load_wordlist(src: str = WORDS_LIST_FILE, packed: str = WORDS_PACKED_FILE) -> Wordlist:
+    """
+    Open the packed wordlist, compiling it from the text file first if it is missing or stale.
+    Without the text file, the packed wordlist is used as it is.
+    :param src: Path of the text wordlist
+    :param packed: Path of the packed wordlist
+    :return: Wordlist
+    """
+    try:
+        if not os.path.exists(src) or os.path.getmtime(packed) >= os.path.getmtime(src):
+            return Wordlist.open(packed)
+    except (OSError, ValueError):
+        pass
+
+    data = pack_words(src)
+
+    try:
+        tmp = packed + ".tmp"
+        with open(tmp, "wb") as file:
+            file.write(data)
+        os.replace(tmp, packed)
+    except OSError:
+        # read-only installs keep the compiled list in memory for this session
+        return Wordlist(data)
+
+    return Wordlist.open(packed)
+
+
+words = None
+
+
+def get_wordlist() -> Wordlist:
+    """
+    :return: The passphrase wordlist, loaded on first use
+    """
+    global words
+
+    if words is None:
+        words = load_wordlist()
+    return words
+
+
+def alphabet(uppercase: bool = True, lowercase: bool = True, digits: bool = True, symbols: bool = True) -> str:
+    """
+    :return: Characters passwords are drawn from
+    """
     chars = str()
 
     if uppercase:
@@ -24,12 +148,196 @@ def generate_password(uppercase: bool = True, lowercase: bool = True, digits: bo
     if symbols:
         chars += string.punctuation
 
-    password = "".join(secrets.choice(chars) for _ in range(length))
+    return chars
+
+
+def random_chars(chars: str):
+    """
+    Uniformly random characters of an alphabet, drawn from os.urandom in blocks.
+    Every byte maps to the character at its value modulo the alphabet size, and
+    the bytes past the last whole multiple of it are dropped, so no character is
+    more likely than another. bytes.translate does both for a whole block at once.
+    Yields runs of random characters as bytes; ask for more by sending the number
+    of characters still needed.
+    :param chars: ASCII alphabet of at most 256 characters
+    """
+    size = len(chars)
+    if not 0 < size <= 256:
+        raise ValueError("The alphabet must have between 1 and 256 characters")
 
-    return password
+    encoded = chars.encode("ascii")
+    limit = 256 - 256 % size
+    table = bytes(encoded[i % size] for i in range(limit)) + bytes(256 - limit)
+    rejected = bytes(range(limit, 256))
+
+    needed = yield b""
+    while True:
+        # enough bytes to cover the rejected ones most of the time
+        request = min(RANDOM_BLOCK, needed * 256 // limit + 16)
+        needed = yield os.urandom(request).translate(table, rejected)
+
+
+def random_below(n: int):
+    """
+    Uniformly random integers in [0, n), drawn from os.urandom in blocks of uint32.
+    Values past the last whole multiple of n are dropped.
+    Yields lists of random integers; ask for more by sending how many are still needed.
+    :param n: Upper bound, at most 2 ** 32
+    """
+    if not 0 < n <= 1 << 32:
+        raise ValueError("n must be between 1 and 2 ** 32")
+
+    limit = (1 << 32) - (1 << 32) % n
+
+    needed = yield []
+    while True:
+        request = min(RANDOM_BLOCK // 4, needed * (1 << 32) // limit + 4)
+        values = array("I", os.urandom(request * 4))
+        needed = yield [value % n for value in values if value < limit]
+
+
+def generate_passwords(
+    count: int,
+    uppercase: bool = True,
+    lowercase: bool = True,
+    digits: bool = True,
+    symbols: bool = True,
+    length: int = 24,
+):
+    """
+    Generate many passwords at once, streaming them as they are made
+    :param count: Number of passwords
+    :param length: Characters per password
+    :return: Generator of passwords
+    """
+    if length < 0:
+        raise ValueError("The length cannot be negative")
+
+    source = random_chars(alphabet(uppercase, lowercase, digits, symbols))
+    next(source)
+
+    buffer = bytearray()
+    for remaining in range(count, 0, -1):
+        # at least the rest of this password, the source caps each read at RANDOM_BLOCK
+        while len(buffer) < length:
+            buffer += source.send(max(length, min(remaining * length, RANDOM_BLOCK)) - len(buffer))
+
+        yield buffer[:length].decode("ascii")
+        del buffer[:length]
+
+
+def generate_passphrases(count: int, length: int = 6, separator: str = "-"):
+    """
+    Generate many passphrases at once, streaming them as they are made
+    :param count: Number of passphrases
+    :param length: Words per passphrase
+    :param separator: Text between words
+    :return: Generator of passphrases
+    """
+    if length < 0:
+        raise ValueError("The length cannot be negative")
+
+    wordlist = get_wordlist()
+    source = random_below(len(wordlist))
+    next(source)
+
+    indices = []
+    for remaining in range(count, 0, -1):
+        # at least the rest of this passphrase, the source caps each read at RANDOM_BLOCK
+        while len(indices) < length:
+            indices += source.send(max(length, min(remaining * length, RANDOM_BLOCK // 4)) - len(indices))
+
+        yield separator.join(wordlist[i] for i in indices[:length])
+        del indices[:length]
+
+
+@lru_cache(maxsize=32)
+def password_policy(uppercase: bool = True, lowercase: bool = True, digits: bool = True, symbols: bool = True, length: int = 24) -> Policy:
+    """
+    Policy of generate_password: at least one character of every enabled class,
+    when the password is long enough to hold one of each
+    """
+    enabled = [name for name, on in zip(CLASSES, (uppercase, lowercase, digits, symbols)) if on]
+    minimum = int(length >= len(enabled))
+    return Policy(length, dict.fromkeys(enabled, minimum))
+
+
+def generate_password(uppercase: bool = True, lowercase: bool = True, digits: bool = True, symbols: bool = True, length: int = 24):
+    return password_policy(uppercase, lowercase, digits, symbols, length).generate()
 
 
 def generate_passphrase(length: int = 6, separator: str = "-"):
-    passphrase = separator.join(secrets.choice(WORDS_LIST) for _ in range(length))
+    return next(generate_passphrases(1, length, separator))
+
+
+def main(argv: list = None, prog: str = "python -m modules.pwgen"):
+    """
+    Command line entry point
+    :param argv: Arguments, sys.argv[1:] if None
+    :param prog: Program name shown in usage and errors
+    """
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description="Print random passwords or passphrases, one per line",
+    )
+    parser.add_argument("count", type=int, nargs="?", default=1, help="how many to generate (default 1)")
+    parser.add_argument("-l", "--length", type=int, help="characters per password (24) or words per passphrase (6)")
+    parser.add_argument("-p", "--passphrase", action="store_true", help="generate passphrases")
+    parser.add_argument("-s", "--separator", default="-", help="text between passphrase words (default -)")
+    parser.add_argument("--no-uppercase", action="store_true", help="leave out uppercase letters")
+    parser.add_argument("--no-lowercase", action="store_true", help="leave out lowercase letters")
+    parser.add_argument("--no-digits", action="store_true", help="leave out digits")
+    parser.add_argument("--no-symbols", action="store_true", help="leave out symbols")
+
+    policy = parser.add_argument_group("password policy", "passwords are drawn uniformly from those satisfying every rule")
+    for name in CLASSES:
+        policy.add_argument(f"--min-{name}", type=int, default=0, metavar="N", help=f"at least N {name}")
+    policy.add_argument("--no-ambiguous", action="store_true", help="leave out characters easily mistaken for one another")
+    policy.add_argument("--exclude", default="", metavar="CHARS", help="leave out these characters")
+    policy.add_argument("--max-repeat", type=int, metavar="N", help="the same character at most N times in a row")
+    policy.add_argument("--pattern", default="", help="classes of the first characters, e.g. [ul]?d: a letter, anything, a digit")
+
+    parser.add_argument("--entropy", action="store_true", help="print the entropy in bits to stderr")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.passphrase:
+            generated = generate_passphrases(args.count, args.length or 6, args.separator)
+            bits = (args.length or 6) * math.log2(len(get_wordlist()))
+        else:
+            enabled = [name for name in CLASSES if not getattr(args, f"no_{name}")]
+            minimums = {name: getattr(args, f"min_{name}") for name in enabled}
+            for name in CLASSES:
+                if name not in enabled and getattr(args, f"min_{name}"):
+                    parser.error(f"--min-{name} needs {name} enabled")
+
+            rules = Policy(
+                args.length or 24,
+                minimums,
+                args.exclude,
+                args.no_ambiguous,
+                args.max_repeat,
+                args.pattern,
+            )
+            bits = rules.entropy()
+
+            if any(minimums.values()) or args.exclude or args.no_ambiguous or args.max_repeat or args.pattern:
+                generated = rules.generate_many(args.count)
+            else:
+                # no rules beyond the classes: every character is independent
+                generated = generate_passwords(args.count, *(name in enabled for name in CLASSES), args.length or 24)
+
+        if args.entropy:
+            print(f"{bits:.2f} bits", file=sys.stderr)
+
+        # write in chunks, a line at a time is slower than generating
+        while chunk := list(islice(generated, OUTPUT_CHUNK)):
+            sys.stdout.write("\n".join(chunk) + "\n")
+    except ValueError as e:
+        parser.error(str(e))
+    except OSError as e:
+        parser.exit(1, f"{parser.prog}: {e}\n")
+
 
-    return passphrase
\ No newline at end of file
+if __name__ == "__main__":
+    main()
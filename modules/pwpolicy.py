@@ -0,0 +1,238 @@
+"""
+Password policies: composition rules a generated password must satisfy.
+
+A policy is compiled into a table counting, for every position and state, the
+passwords that can still be completed from it. Generation walks the table and
+decodes one random number below the total count into the password of that
+rank, so every password satisfying the policy is equally likely and none is
+ever generated and thrown away. The total count is the exact entropy.
+
+Characters of one class are interchangeable, so a state only tracks:
+- how many characters of each class were used, up to the class minimum,
+- the class of the last character and how many times in a row it appeared,
+  when repeats are limited.
+"""
+
+import math
+import re
+import secrets
+import string
+from itertools import product
+
+# class name: (pattern letter, characters)
+CLASSES = {
+    "uppercase": ("u", string.ascii_uppercase),
+    "lowercase": ("l", string.ascii_lowercase),
+    "digits": ("d", string.digits),
+    "symbols": ("s", string.punctuation),
+}
+
+# pattern letter of a position any enabled class may fill
+PATTERN_ANY = "?"
+
+# one pattern position: a letter, or letters of alternative classes in brackets
+PATTERN_POSITION = re.compile(r"\[([^\]]+)\]|(.)")
+
+# characters easily mistaken for one another
+AMBIGUOUS = "0OoIl1|`'\""
+
+
+class Policy:
+    """
+    Compiled password policy
+    """
+    def __init__(
+        self,
+        length: int = 24,
+        minimums: dict = None,
+        exclude: str = "",
+        exclude_ambiguous: bool = False,
+        max_repeat: int = None,
+        pattern: str = "",
+    ):
+        """
+        :param length: Characters per password
+        :param minimums: {class name: least characters of the class} for every class passwords
+                         may use, see CLASSES. None uses all classes, without minimums
+        :param exclude: Characters never used
+        :param exclude_ambiguous: Also never use the characters in AMBIGUOUS
+        :param max_repeat: Most times the same character may appear in a row, None for no limit
+        :param pattern: Classes allowed at the first positions, one pattern letter each (see CLASSES)
+                        or several in brackets, PATTERN_ANY for any class.
+                        "[ul]??d" starts with a letter and has a digit fourth
+        """
+        if minimums is None:
+            minimums = dict.fromkeys(CLASSES, 0)
+        if exclude_ambiguous:
+            exclude += AMBIGUOUS
+
+        if length < 0:
+            raise ValueError("The length cannot be negative")
+        if max_repeat is not None and max_repeat < 1:
+            raise ValueError("Characters must be allowed at least once in a row")
+
+        self.length = length
+        self.max_repeat = max_repeat
+        self.names = []
+        self.chars = []
+        self.minimums = []
+
+        for name, minimum in minimums.items():
+            if name not in CLASSES:
+                raise ValueError(f"Unknown character class: {name}")
+
+            chars = "".join(c for c in CLASSES[name][1] if c not in exclude)
+            if not chars:
+                if minimum > 0:
+                    raise ValueError(f"Every character of {name} is excluded")
+                continue
+
+            self.names.append(name)
+            self.chars.append(chars)
+            self.minimums.append(max(minimum, 0))
+
+        if not self.chars:
+            raise ValueError("No characters are allowed")
+
+        self.allowed = self.parse_pattern(pattern)
+        self.initial = (tuple(0 for _ in self.chars), None, 0)
+        self.choices = self.list_moves()
+        self.table = self.compile()
+        self.count = self.table[0][self.initial]
+
+        if self.count == 0:
+            raise ValueError("No password satisfies the policy")
+
+    def parse_pattern(self, pattern: str) -> list:
+        """
+        :return: Indices of the classes allowed at each position
+        """
+        letters = {CLASSES[name][0]: k for k, name in enumerate(self.names)}
+        every = tuple(range(len(self.chars)))
+
+        allowed = []
+        for match in PATTERN_POSITION.finditer(pattern):
+            position = match.group(1) or match.group(2)
+            if PATTERN_ANY in position:
+                allowed.append(every)
+                continue
+
+            for letter in position:
+                if letter not in letters:
+                    raise ValueError(f"Pattern letter {letter!r} is not an allowed class")
+            allowed.append(tuple(sorted({letters[letter] for letter in position})))
+
+        if len(allowed) > self.length:
+            raise ValueError("The pattern is longer than the password")
+
+        return allowed + [every] * (self.length - len(allowed))
+
+    def states(self) -> list:
+        """
+        :return: Every (class counts, last class, times in a row) a password can reach
+        """
+        counts = list(product(*(range(minimum + 1) for minimum in self.minimums)))
+
+        tails = [(None, 0)]
+        if self.max_repeat is not None:
+            tails += [(k, run) for k in range(len(self.chars)) for run in range(1, self.max_repeat + 1)]
+
+        return [(count, last, run) for count in counts for last, run in tails]
+
+    def moves(self, position: int, state: tuple):
+        """
+        Ways to choose the character at a position.
+        Yields (class, whether the last character is repeated, characters, next state)
+        """
+        counts, last, run = state
+        for k in self.allowed[position]:
+            following = counts[:k] + (min(counts[k] + 1, self.minimums[k]), ) + counts[k + 1:]
+            size = len(self.chars[k])
+
+            if self.max_repeat is None:
+                yield k, False, size, (following, None, 0)
+            elif k != last:
+                yield k, False, size, (following, k, 1)
+            else:
+                if size > 1:
+                    yield k, False, size - 1, (following, k, 1)
+                if run < self.max_repeat:
+                    yield k, True, 1, (following, k, run + 1)
+
+    def list_moves(self) -> dict:
+        """
+        :return: {allowed classes: {state: list of moves()}}, positions past the pattern share theirs
+        """
+        states = self.states()
+
+        choices = {}
+        for allowed in set(self.allowed):
+            position = self.allowed.index(allowed)
+            choices[allowed] = {state: list(self.moves(position, state)) for state in states}
+
+        return choices
+
+    def compile(self) -> list:
+        """
+        :return: For each position, {state: number of ways to complete the password from it}
+        """
+        states = self.states()
+        complete = tuple(self.minimums)
+
+        table = [None] * (self.length + 1)
+        table[self.length] = {state: int(state[0] == complete) for state in states}
+
+        for position in range(self.length - 1, -1, -1):
+            after = table[position + 1]
+            table[position] = {
+                state: sum([ways * after[following] for _, _, ways, following in moves])
+                for state, moves in self.choices[self.allowed[position]].items()
+            }
+
+        return table
+
+    def entropy(self) -> float:
+        """
+        :return: Bits of entropy of a password drawn from the policy, log2 of the number of passwords
+        """
+        return math.log2(self.count)
+
+    def generate(self) -> str:
+        """
+        :return: Uniformly random password satisfying the policy
+        """
+        state = self.initial
+        password = []
+
+        # rank of the password among all passwords completing the current state
+        pick = secrets.randbelow(self.count)
+
+        for position in range(self.length):
+            after = self.table[position + 1]
+
+            for k, repeat, ways, following in self.choices[self.allowed[position]][state]:
+                weight = ways * after[following]
+                if pick < weight:
+                    break
+                pick -= weight
+
+            if repeat:
+                password.append(password[-1])
+            else:
+                chars = self.chars[k]
+                if k == state[1]:
+                    chars = chars.replace(password[-1], "")
+                index, pick = divmod(pick, after[following])
+                password.append(chars[index])
+
+            state = following
+
+        return "".join(password)
+
+    def generate_many(self, count: int):
+        """
+        :param count: Number of passwords
+        :return: Generator of passwords
+        """
+        for _ in range(count):
+            yield self.generate()
@@ -1,12 +1,37 @@
 """
 Password assessment utilities:
 - pwquality(): rate strength with zxcvbn
+- pwquality_many(): rate many passwords with zxcvbn across processes
 - check_pwned(): query HaveIBeenPwned API
+- check_pwned_many(): query HaveIBeenPwned API for many passwords at once
+- check_pwned_iter(): the same, streaming counts as each range arrives
+- set_offline_dataset(): answer both from a local Pwned Passwords dataset instead
 """
 
 import hashlib
+import hmac
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
 import requests
 import zxcvbn
+from modules.hibpcache import Range
+from modules.hibpoffline import OfflineDataset
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+API_URL = "https://api.pwnedpasswords.com/range/"
+
+# concurrent range requests
+MAX_WORKERS = 8
+
+# retries per range request, with exponential backoff
+RETRIES = 3
+BACKOFF = 0.5
+
+# local dataset used instead of the API, see set_offline_dataset()
+offline_dataset = None
 
 
 def pwquality(password: str) -> int:
@@ -21,6 +46,90 @@ def pwquality(password: str) -> int:
     return zxcvbn.zxcvbn(password)["score"]
 
 
+def pwquality_many(passwords, max_workers: int = None, cache=None):
+    """
+    Score many passwords with zxcvbn across a process pool.
+    Yields (position, score) as each score is ready; cached scores come first.
+    :param passwords: Passwords to assess
+    :param max_workers: Number of processes (default: all cores)
+    :param cache: ScoreCache of previous scores (optional)
+    """
+    pending = {}
+    for i, password in enumerate(passwords):
+        score = cache.get(password) if cache is not None else None
+        if score is None:
+            pending[i] = password
+        else:
+            yield (i, score)
+
+    if not pending:
+        return
+
+    # spawn keeps workers from inheriting the GUI's threads
+    pool = ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        futures = {pool.submit(pwquality, password): i for i, password in pending.items()}
+        for future in as_completed(futures):
+            i = futures[future]
+            score = future.result()
+            if cache is not None:
+                cache.put(pending[i], score)
+            yield (i, score)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+class ScoreCache:
+    """
+    zxcvbn scores keyed by an HMAC of the password,
+    so unchanged passwords are not scored again and plaintext is never kept.
+    """
+    def __init__(self, key: bytes, data: bytes = None):
+        self.key = key
+        self.scores = json.loads(data) if data else {}
+        self.used = set()
+
+    def fingerprint(self, password: str) -> str:
+        """
+        HMAC of a password; its score is kept by the next prune()
+        :param password: Password
+        :return: Hex digest
+        """
+        mac = hmac.new(self.key, password.encode("utf-8"), "sha256").hexdigest()
+        self.used.add(mac)
+        return mac
+
+    def get(self, password: str):
+        return self.scores.get(self.fingerprint(password))
+
+    def put(self, password: str, score: int):
+        self.scores[self.fingerprint(password)] = score
+
+    def prune(self):
+        """
+        Forget scores of passwords not looked up since the cache was loaded
+        """
+        self.scores = {mac: score for mac, score in self.scores.items() if mac in self.used}
+
+    def dumps(self) -> bytes:
+        return json.dumps(self.scores, separators=(",", ":")).encode()
+
+
+def set_offline_dataset(path):
+    """
+    Answer breach checks from a dataset built by hibpoffline.import_dump().
+    If it cannot be opened, checks go back to the API and the error is raised.
+    :param path: Path of the dataset, None to go back to the API
+    """
+    global offline_dataset
+
+    if offline_dataset is not None:
+        offline_dataset.close()
+        offline_dataset = None
+    if path:
+        offline_dataset = OfflineDataset(path)
+
+
 def check_pwned(password: str) -> int:
     """
     Check if password appears in HaveIBeenPwned (HIBP).
@@ -28,19 +137,140 @@ def check_pwned(password: str) -> int:
     :param password: Password to check
     :return: number of times seen in breaches, -1 if API unavailable
     """
+    return check_pwned_many([password])[0]
+
+
+def check_pwned_many(passwords, url: str = API_URL, max_workers: int = MAX_WORKERS, cache=None) -> list:
+    """
+    Check many passwords against HaveIBeenPwned (HIBP).
+    Each SHA1 prefix range is fetched only once, concurrently over one pooled session.
+    :param passwords: Passwords to check
+    :param url: Range API base url
+    :param max_workers: Maximum concurrent requests
+    :param cache: hibpcache.RangeCache to reuse and revalidate ranges (optional)
+    :return: number of times each password was seen in breaches, -1 where the API was unavailable
+    """
+    passwords = list(passwords)
+
+    counts = [-1] * len(passwords)
+    for i, count in check_pwned_iter(passwords, url, max_workers, cache):
+        counts[i] = count
+
+    return counts
+
+
+def check_pwned_iter(passwords, url: str = API_URL, max_workers: int = MAX_WORKERS, cache=None):
+    """
+    Check many passwords against HaveIBeenPwned (HIBP) like check_pwned_many(),
+    yielding (position, count) for the passwords of each range as soon as it arrives.
+    Ranges not fetched yet are dropped when the generator is closed.
+    :param passwords: Passwords to check
+    :param url: Range API base url
+    :param max_workers: Maximum concurrent requests
+    :param cache: hibpcache.RangeCache to reuse and revalidate ranges (optional)
+    """
+    if offline_dataset is not None:
+        yield from enumerate(offline_dataset.check_many(passwords))
+        return
+
+    suffixes = []
+    positions = {}
+    for i, password in enumerate(passwords):
+        prefix, suffix = sha1_split(password)
+        suffixes.append(suffix)
+        positions.setdefault(prefix, []).append(i)
+
+    if not positions:
+        return
+
+    session = new_session(max_workers)
+    pool = ThreadPoolExecutor(max_workers)
+    try:
+        futures = {pool.submit(fetch_range, session, url, prefix, cache): prefix for prefix in positions}
+        for future in as_completed(futures):
+            counts = future.result()
+            for i in positions[futures[future]]:
+                yield (i, -1 if counts is None else counts.get(suffixes[i], 0))
+
+        if cache is not None:
+            cache.evict()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+        session.close()
+
+
+def sha1_split(password: str) -> tuple:
+    """
+    Split the SHA1 of a password into the range prefix and suffix
+    :param password: Password to hash
+    :return: (5 char prefix, 35 char suffix), upper case hex
+    """
     sha1 = hashlib.sha1(password.encode("utf-8")).hexdigest().upper()
-    prefix, suffix = sha1[:5], sha1[5:]
+    return sha1[:5], sha1[5:]
+
+
+def new_session(max_workers: int = MAX_WORKERS) -> requests.Session:
+    """
+    Create a session with a connection pool and retry/backoff for range requests
+    :param max_workers: Number of connections to keep
+    :return: Session
+    """
+    retry = Retry(
+        total=RETRIES,
+        backoff_factor=BACKOFF,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET", ),
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_range(session: requests.Session, url: str, prefix: str, cache=None):
+    """
+    Fetch one range from the cache or the API
+    :param session: Session to use
+    :param url: Range API base url
+    :param prefix: 5 char SHA1 prefix
+    :param cache: hibpcache.RangeCache (optional)
+    :return: mapping of suffix -> count with a get() method, None if API unavailable
+    """
+    cached = cache.get(prefix) if cache is not None else None
+    if cached is not None and cache.is_fresh(cached):
+        return cached
+
+    # a stale range is revalidated instead of downloaded again
+    headers = {}
+    if cached is not None and cached.etag:
+        headers["If-None-Match"] = cached.etag
 
-    url = f"https://api.pwnedpasswords.com/range/{prefix}"
     try:
-        res = requests.get(url, timeout=5)
+        res = session.get(url + prefix, headers=headers, timeout=5)
         res.raise_for_status()
     except Exception:
-        return -1
+        return cached
+
+    if res.status_code == 304 and cached is not None:
+        cache.touch(prefix, cached)
+        return cached
+
+    counts = parse_range(res.text)
+    if cache is None:
+        return counts
 
-    hashes = (line.split(":") for line in res.text.splitlines())
-    for h, c in hashes:
-        if h == suffix:
-            return int(c)
+    rng = Range.from_counts(counts, res.headers.get("ETag", ""))
+    cache.put(prefix, rng)
+    return rng
 
-    return 0
+
+def parse_range(text: str) -> dict:
+    """
+    Parse a range response
+    :param text: Response body
+    :return: dict of suffix -> count
+    """
+    hashes = (line.split(":") for line in text.splitlines())
+    return {h: int(c) for h, c in hashes}
@@ -0,0 +1,96 @@
+"""
+In-memory search index over entry titles and usernames
+"""
+
+import json
+
+# joins title and username so a query can never match across both
+SEPARATOR = "\x1f"
+
+
+class SearchIndex:
+    def __init__(self):
+        self.entries = {}
+        self.texts = None
+        self.last = None
+
+    def add(self, entry_id: int, title: str, username: str):
+        """
+        Add or replace an entry in the index
+        :param entry_id: Entry id
+        :param title: Decrypted title
+        :param username: Decrypted username
+        """
+        self.entries[entry_id] = (title, username)
+        self.texts = None
+        self.last = None
+
+    def remove(self, entry_id: int):
+        """
+        Remove an entry from the index
+        :param entry_id: Entry id
+        """
+        self.entries.pop(entry_id, None)
+        self.texts = None
+        self.last = None
+
+    def title(self, entry_id: int) -> str:
+        """
+        Get the title of an indexed entry
+        :param entry_id: Entry id
+        :return: Decrypted title
+        """
+        return self.entries[entry_id][0]
+
+    def ids(self) -> list:
+        """
+        Get all indexed entry ids
+        :return: Entry ids in insertion order
+        """
+        return list(self.entries)
+
+    def search(self, query: str) -> list:
+        """
+        Case-insensitive substring search over titles and usernames
+        :param query: Search text
+        :return: Matching entry ids in insertion order
+        """
+        query = query.replace(SEPARATOR, "").lower()
+        if not query:
+            return self.ids()
+
+        if self.texts is None:
+            self.texts = [
+                (entry_id, f"{title}{SEPARATOR}{username}".lower())
+                for entry_id, (title, username) in self.entries.items()
+            ]
+
+        # typing narrows the previous result, so only those need checking
+        candidates = self.texts
+        if self.last is not None and query.startswith(self.last[0]):
+            candidates = self.last[1]
+
+        matches = [(entry_id, text) for entry_id, text in candidates if query in text]
+        self.last = (query, matches)
+
+        return [entry_id for entry_id, _ in matches]
+
+    def dumps(self) -> bytes:
+        """
+        Serialize the index
+        :return: Serialized index
+        """
+        rows = [[entry_id, title, username] for entry_id, (title, username) in self.entries.items()]
+        return json.dumps(rows, separators=(",", ":")).encode()
+
+    @classmethod
+    def loads(cls, data: bytes) -> "SearchIndex":
+        """
+        Deserialize an index produced by dumps()
+        :param data: Serialized index
+        :return: Search index
+        """
+        index = cls()
+        for entry_id, title, username in json.loads(data):
+            index.entries[entry_id] = (title, username)
+        return index
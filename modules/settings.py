@@ -0,0 +1,91 @@
+"""
+Application settings, shared by the GUI and the command line:
+- get_settings(): settings loaded once per process
+- load_stylesheet(): theme stylesheets, read once and kept in memory
+"""
+
+import json
+import os
+from functools import lru_cache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETTINGS_FILE = os.path.join(ROOT, "data", "settings.json")
+
+STYLE_DIR = os.path.join(ROOT, "style")
+
+# values used when settings.json lacks them
+DEFAULTS = {
+    "stylesheet": "nord",
+}
+
+
+class Settings:
+    """
+    Settings file kept in memory. It is written only when a value changes,
+    through a temporary file so it is never left half written.
+    """
+    def __init__(self, path: str = SETTINGS_FILE):
+        self.path = path
+        self.values = self.load()
+
+    def load(self) -> dict:
+        try:
+            with open(self.path) as file:
+                values = json.load(file)
+        except (FileNotFoundError, ValueError):
+            # a missing or unreadable file means the defaults
+            return {}
+
+        return values if isinstance(values, dict) else {}
+
+    def get(self, name: str, default=None):
+        return self.values.get(name, DEFAULTS.get(name, default))
+
+    def set(self, name: str, value) -> bool:
+        """
+        :param name: Setting
+        :param value: JSON serializable value
+        :return: True if the value changed and was saved
+        """
+        if name in self.values and self.values[name] == value:
+            return False
+
+        self.values[name] = value
+        self.save()
+        return True
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as file:
+            json.dump(self.values, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, self.path)
+
+
+loaded = None
+
+
+def get_settings() -> Settings:
+    """
+    :return: The settings of this process, loaded on first use
+    """
+    global loaded
+
+    if loaded is None:
+        loaded = Settings()
+    return loaded
+
+
+@lru_cache(maxsize=None)
+def load_stylesheet(name: str) -> str:
+    """
+    :param name: Theme, the name of a .qss file in STYLE_DIR
+    :return: Stylesheet
+    """
+    if os.path.basename(name) != name:
+        raise ValueError(f"Not a theme name: {name}")
+
+    with open(os.path.join(STYLE_DIR, name + ".qss")) as file:
+        return file.read()
@@ -0,0 +1,118 @@
+"""
+Near-duplicate password detection with MinHash and locality sensitive hashing.
+Passwords only become candidates when they share a band of their MinHash
+signature, so the whole vault is never compared pairwise.
+"""
+
+import hashlib
+import random
+from collections import defaultdict
+
+NGRAM = 3
+
+# signature of BANDS * ROWS hashes; passwords sharing any band become candidates.
+# A pair at Jaccard similarity s is missed with probability (1 - s ** ROWS) ** BANDS:
+# 0.2% at 0.57, 1% at THRESHOLD
+BANDS = 16
+ROWS = 2
+
+# minimum Jaccard similarity of n-gram sets for a candidate pair to count
+THRESHOLD = 0.5
+
+PRIME = (1 << 61) - 1
+
+
+def make_permutations(count: int, seed: int = 0x5EED) -> list:
+    """
+    Random (a, b) pairs for the hash functions h -> (a * h + b) mod PRIME
+    :param count: Number of hash functions
+    :param seed: Seed, fixed so signatures are stable between runs
+    :return: List of (a, b)
+    """
+    rng = random.Random(seed)
+    return [(rng.randrange(1, PRIME), rng.randrange(0, PRIME)) for _ in range(count)]
+
+
+PERMUTATIONS = make_permutations(BANDS * ROWS)
+
+
+def ngrams(password: str) -> frozenset:
+    """
+    Case-insensitive character n-grams of a password, with start and end markers
+    :param password: Password
+    :return: Set of n-grams
+    """
+    padded = f"\x02{password.lower()}\x03"
+    return frozenset(padded[i:i + NGRAM] for i in range(max(1, len(padded) - NGRAM + 1)))
+
+
+def gram_hash(gram: str) -> int:
+    """
+    Hash of an n-gram, the same in every process unlike hash()
+    """
+    return int.from_bytes(hashlib.blake2b(gram.encode(), digest_size=8).digest(), "big")
+
+
+def signature(grams: frozenset) -> tuple:
+    """
+    MinHash signature of an n-gram set
+    :param grams: Set of n-grams
+    :return: BANDS * ROWS minimum hash values
+    """
+    hashes = [gram_hash(gram) % PRIME for gram in grams]
+    return tuple(min([(a * h + b) % PRIME for h in hashes]) for a, b in PERMUTATIONS)
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    return len(a & b) / len(a | b)
+
+
+def similar_groups(passwords, threshold: float = THRESHOLD) -> list:
+    """
+    Group passwords that are near-duplicates of each other.
+    Identical passwords are grouped only when a different but similar one joins them.
+    :param passwords: Passwords to compare
+    :param threshold: Minimum Jaccard similarity of n-gram sets
+    :return: Lists of positions in passwords, one per group
+    """
+    # identical passwords are handled once
+    positions = defaultdict(list)
+    for i, password in enumerate(passwords):
+        positions[password].append(i)
+    unique = list(positions)
+    grams = [ngrams(password) for password in unique]
+
+    buckets = defaultdict(list)
+    for i, g in enumerate(grams):
+        sig = signature(g)
+        for band in range(BANDS):
+            buckets[(band, sig[band * ROWS:(band + 1) * ROWS])].append(i)
+
+    # union-find over verified candidate pairs
+    parent = list(range(len(unique)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    checked = set()
+    for members in buckets.values():
+        for x in range(len(members)):
+            for y in range(x + 1, len(members)):
+                i, j = members[x], members[y]
+                if (i, j) in checked:
+                    continue
+                checked.add((i, j))
+                if find(i) != find(j) and jaccard(grams[i], grams[j]) >= threshold:
+                    parent[find(i)] = find(j)
+
+    groups = defaultdict(list)
+    for i in range(len(unique)):
+        groups[find(i)].append(i)
+
+    return [
+        sorted(pos for i in members for pos in positions[unique[i]])
+        for members in groups.values() if len(members) > 1
+    ]
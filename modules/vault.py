@@ -3,8 +3,16 @@ Interact with sqlite3 databases.
 """
 
 import os
+import json
+import time
 import sqlite3
-from modules import crypt
+import struct
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+from modules import crypt, db, migrations
+from modules.search import SearchIndex
 
 DB_SCHEMA = """
 CREATE TABLE IF NOT EXISTS meta (
@@ -14,124 +22,723 @@ CREATE TABLE IF NOT EXISTS meta (
 
 CREATE TABLE IF NOT EXISTS entries (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
-    title BLOB NOT NULL,
-    username BLOB NOT NULL,
-    password BLOB NOT NULL
+    record BLOB NOT NULL,
+    created INTEGER,
+    modified INTEGER
 );
 """
 
+# version of DB_SCHEMA; older vaults are upgraded by modules.migrations
+SCHEMA_VERSION = 3
+
+# lengths of the title and username of a record; the password is the rest
+RECORD = struct.Struct(">II")
+
+# authenticated with every record so records cannot be swapped between rows
+RECORD_HEADER = struct.Struct(">Q")
+
+# number of decrypted entries kept in memory
+CACHE_SIZE = 64
+
+DECRYPTION_FAILED = "<decryption failed>"
+
+# rows decrypted, re-encrypted or imported per batch
+BATCH_SIZE = 500
+
+# key derivation parameters of vaults created before they were stored in meta
+DEFAULT_KDF = {
+    "time_cost": crypt.ARGON2_TIME_COST,
+    "memory_cost": crypt.ARGON2_MEMORY_COST,
+    "parallelism": crypt.ARGON2_PARALLELISM,
+}
+
+def pack_record(title: str, username: str, password: str) -> bytes:
+    title, username = title.encode(), username.encode()
+    return RECORD.pack(len(title), len(username)) + title + username + password.encode()
+
+
+def unpack_record(data: bytes) -> tuple:
+    title_length, username_length = RECORD.unpack_from(data)
+    start = RECORD.size
+    middle = start + title_length
+    end = middle + username_length
+
+    return (data[start:middle].decode(), data[middle:end].decode(), data[end:].decode())
+
+
 class Vault:
     def __init__(self, path: os.PathLike) -> None:
         self.path = path
         self.conn = None
-        self.aes = None
+        self.cipher = None
+        self.cache = OrderedDict()
+        self.index = None
+        self.index_saved = False
+        # search index changes waiting for the current transaction to commit
+        self.pending = []
     
     def open(self):
         first_time = not os.path.exists(self.path)
-        
-        conn = sqlite3.connect(self.path)
-        cur = conn.cursor()
-        cur.executescript(DB_SCHEMA)
-        conn.commit()
-        
+
+        conn = db.connect(self.path)
+
+        version = db.get_schema_version(conn)
+        if version == 0:
+            db.create_schema(conn, DB_SCHEMA, SCHEMA_VERSION)
+        elif version > SCHEMA_VERSION:
+            conn.close()
+            raise ValueError("Vault was created by a newer version")
+
         self.conn = conn
         self.first_time = first_time
 
-    def unlock(self, password: bytes):
+    def needs_migration(self) -> bool:
+        assert self.conn is not None
+
+        return bool(migrations.pending(self, SCHEMA_VERSION))
+
+    def migrate(self):
+        """
+        Upgrade the database to SCHEMA_VERSION before the vault is used.
+        Yields (status, done, total); an interrupted upgrade resumes on the next call.
+        """
+        assert self.conn is not None
+
+        yield from migrations.migrate(self, SCHEMA_VERSION)
+
+    def get_kdf(self) -> dict:
+        assert self.conn is not None
+
+        cur = self.conn.cursor()
+        cur.execute("SELECT v FROM meta WHERE k='kdf'")
+        row = cur.fetchone()
+        if row is None:
+            return dict(DEFAULT_KDF)
+
+        return json.loads(row[0])
+
+    def get_cipher(self) -> str:
+        """
+        :return: Name of the cipher in crypt.CIPHERS the vault is encrypted with
+        """
+        assert self.conn is not None
+
+        cur = self.conn.cursor()
+        cur.execute("SELECT v FROM meta WHERE k='cipher'")
+        row = cur.fetchone()
+        if row is None:
+            # vaults from before the cipher was stored
+            return "aes-gcm"
+
+        return row[0].decode()
+
+    def new_cipher(self, name: str, key: bytes):
+        if name not in crypt.CIPHERS:
+            raise ValueError(f"Unknown cipher {name}")
+
+        return crypt.CIPHERS[name](key)
+
+    def get_keycheck(self) -> bytes:
+        """
+        :return: Digest of the vault key, stored to check passwords
+        """
+        assert self.conn is not None
+
+        cur = self.conn.cursor()
+        cur.execute("SELECT v FROM meta WHERE k='keycheck'")
+
+        return cur.fetchone()[0]
+
+    def derive_key(self, password: bytes):
+        """
+        :param password: Master password
+        :return: Key derived with the stored salt and parameters, None if the password is wrong
+        """
         assert self.conn is not None
 
         cur = self.conn.cursor()
         cur.execute("SELECT v FROM meta WHERE k='salt'")
 
         salt = cur.fetchone()[0]
-        key = crypt.argon2_derive(password, salt, 32)
+        key = crypt.argon2_derive(password, salt, 32, **self.get_kdf())
 
         cur.execute("SELECT v FROM meta WHERE k='keycheck'")
         stored_check = cur.fetchone()[0]
 
         if not crypt.compare(crypt.digest(key), stored_check):
+            return None
+
+        return key
+
+    def unlock(self, password: bytes):
+        assert self.conn is not None
+
+        key = self.derive_key(password)
+        if key is None:
             return 1
 
-        aes = crypt.AESGCM(key)
+        cipher = self.new_cipher(self.get_cipher(), key)
         del key
 
-        self.aes = aes
+        self.cipher = cipher
 
-    def initialize(self, password: bytes):
+    def initialize(self, password: bytes, kdf: dict = None, cipher: str = None):
         assert self.conn is not None
 
+        kdf = kdf or dict(DEFAULT_KDF)
+        cipher = cipher or crypt.DEFAULT_CIPHER
         salt = crypt.generate(128)
-        key = crypt.argon2_derive(password, salt, 32)
+        key = crypt.argon2_derive(password, salt, 32, **kdf)
 
-        aes = crypt.AESGCM(key)
+        new = self.new_cipher(cipher, key)
         keycheck = crypt.digest(key)
         del key
 
-        cur = self.conn.cursor()
-        cur.execute("INSERT INTO meta (k, v) VALUES (?, ?)", ("salt", salt))
-        cur.execute("INSERT INTO meta (k, v) VALUES (?, ?)", ("keycheck", keycheck))
-        self.commit()
+        values = [
+            ("salt", salt),
+            ("keycheck", keycheck),
+            ("kdf", json.dumps(kdf).encode()),
+            ("cipher", cipher.encode()),
+        ]
+        with self.transaction():
+            self.conn.executemany("INSERT INTO meta (k, v) VALUES (?, ?)", values)
+
+        self.cipher = new
+
+    def rekey(self, password: bytes, kdf: dict = None, cipher: str = None):
+        """
+        Derive a new key from password with new Argon2 parameters and
+        re-encrypt every entry with it in one transaction.
+        Yields (status, done, total); closing the generator early rolls back.
+        :param password: New master password
+        :param kdf: New Argon2 parameters (default: DEFAULT_KDF)
+        :param cipher: Name of the new cipher in crypt.CIPHERS (default: the current one)
+        """
+        assert self.conn is not None
+        assert self.cipher is not None
+
+        kdf = kdf or dict(DEFAULT_KDF)
+        cipher = cipher or self.get_cipher()
+        salt = crypt.generate(128)
+
+        yield ("Deriving key", 0, 0)
+        key = crypt.argon2_derive(password, salt, 32, **kdf)
+
+        new = self.new_cipher(cipher, key)
+        keycheck = crypt.digest(key)
+        del key
+
+        with self.transaction():
+            yield from self.reencrypt(self.cipher, new)
+
+            cur = self.conn.cursor()
+            values = [
+                ("salt", salt),
+                ("keycheck", keycheck),
+                ("kdf", json.dumps(kdf).encode()),
+                ("cipher", cipher.encode()),
+            ]
+            cur.executemany("INSERT OR REPLACE INTO meta (k, v) VALUES (?, ?)", values)
+            self.discard_saved_index(cur)
+
+        self.cipher = new
+
+    def change_cipher(self, password: bytes, cipher: str):
+        """
+        Re-encrypt every entry with another cipher, keeping the master password
+        and key derivation parameters. The key is derived again with a new salt,
+        so no key is ever used with two ciphers.
+        Yields (status, done, total); closing the generator early rolls back.
+        :param password: Current master password
+        :param cipher: Name of the new cipher in crypt.CIPHERS
+        """
+        assert self.conn is not None
+        assert self.cipher is not None
 
-        self.aes = aes
+        yield ("Checking password", 0, 0)
+        if self.derive_key(password) is None:
+            raise ValueError("Wrong master password")
 
-    def get_rows(self):
+        yield from self.rekey(password, self.get_kdf(), cipher)
+
+    def reencrypt(self, old, new):
+        """
+        Re-encrypt every entry from one cipher to another inside the caller's transaction.
+        Rows are read in id order in batches, so memory use does not grow with the vault.
+        Yields (status, done, total).
+        """
         assert self.conn is not None
 
         cur = self.conn.cursor()
-        cur.execute("SELECT id, title, username, password FROM entries")
-        rows = cur.fetchall()
+        cur.execute("SELECT COUNT(*) FROM entries")
+        total = cur.fetchone()[0]
+
+        done = 0
+        last_id = 0
+        while True:
+            yield ("Re-encrypting entries", done, total)
+
+            cur.execute(
+                "SELECT id, record FROM entries WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, BATCH_SIZE),
+            )
+            rows = cur.fetchall()
+            if not rows:
+                break
+
+            headers = [RECORD_HEADER.pack(entry_id) for entry_id, _ in rows]
+            plaintexts = old.decrypt_many([record for _, record in rows], headers)
+            records = new.encrypt_many(plaintexts, headers)
+            cur.executemany(
+                "UPDATE entries SET record=? WHERE id=?",
+                zip(records, (entry_id for entry_id, _ in rows)),
+            )
+
+            done += len(rows)
+            last_id = rows[-1][0]
+
+    def decrypt_fields(self, blobs: list) -> list:
+        # fields were encrypted one by one before schema version 3
+        assert self.cipher is not None
+
+        fields = []
+        for data in self.cipher.decrypt_many(blobs, strict=False):
+            try:
+                fields.append(data.decode())
+            except Exception:
+                fields.append(DECRYPTION_FAILED)
+        return fields
+
+    def encrypt_record(self, entry_id: int, title: str, username: str, password: str) -> bytes:
+        """
+        Seal the fields of an entry into one blob, with one nonce and tag per entry
+        :param entry_id: Row id, authenticated with the record
+        :return: Encrypted record
+        """
+        assert self.cipher is not None
+
+        return self.cipher.encrypt(pack_record(title, username, password), RECORD_HEADER.pack(entry_id))
+
+    def decrypt_record(self, entry_id: int, blob: bytes) -> tuple:
+        """
+        :param entry_id: Row id the record was stored under
+        :param blob: Encrypted record
+        :return: (title, username, password)
+        """
+        assert self.cipher is not None
+
+        try:
+            return unpack_record(self.cipher.decrypt(blob, RECORD_HEADER.pack(entry_id)))
+        except Exception:
+            return (DECRYPTION_FAILED, ) * 3
+
+    def encrypt_records(self, rows: list) -> list:
+        """
+        Seal many entries through the cipher's batch path
+        :param rows: (entry_id, title, username, password) tuples
+        :return: Encrypted records, in order
+        """
+        assert self.cipher is not None
+
+        return self.cipher.encrypt_many(
+            [pack_record(title, username, password) for _, title, username, password in rows],
+            [RECORD_HEADER.pack(entry_id) for entry_id, *_ in rows],
+        )
+
+    def decrypt_records(self, rows: list, cipher=None, strict: bool = False) -> list:
+        """
+        Open many records through the cipher's batch path
+        :param rows: (entry_id, record) tuples
+        :param cipher: Cipher the records were sealed with (default: the vault's)
+        :param strict: Raise ValueError for a record that fails to decrypt, instead of
+                       returning DECRYPTION_FAILED for its fields
+        :return: (title, username, password) tuples, in order
+        """
+        cipher = cipher or self.cipher
+        assert cipher is not None
+
+        plaintexts = cipher.decrypt_many(
+            [record for _, record in rows],
+            [RECORD_HEADER.pack(entry_id) for entry_id, _ in rows],
+            strict=False,
+        )
+
+        entries = []
+        for (entry_id, _), data in zip(rows, plaintexts):
+            try:
+                entries.append(unpack_record(data))
+            except Exception:
+                if strict:
+                    raise ValueError(f"Entry #{entry_id} could not be decrypted")
+                entries.append((DECRYPTION_FAILED, ) * 3)
+        return entries
+
+    def next_id(self, cur: sqlite3.Cursor) -> int:
+        # records are sealed with their id, so ids are taken before inserting;
+        # call inside a transaction so no other writer can take the same id
+        cur.execute("SELECT seq FROM sqlite_sequence WHERE name='entries'")
+        row = cur.fetchone()
+
+        return (row[0] if row else 0) + 1
+
+    def load_index(self):
+        """
+        Restore or build the search index, yielding (status, done, total) as it goes
+        """
+        assert self.conn is not None
+        assert self.cipher is not None
+
+        data = self.get_secret("index")
+
+        index = None
+        if data is not None:
+            try:
+                index = SearchIndex.loads(data)
+            except Exception:
+                index = None
+
+        # a stored index is only trusted if it covers exactly the current rows
+        if index is not None and set(index.ids()) == set(self.get_ids()):
+            self.index = index
+            self.index_saved = True
+        else:
+            self.index = yield from self.build_index()
+            self.index_saved = False
+
+    def build_index(self):
+        """
+        Decrypt every title and username into a new search index,
+        yielding (status, done, total) as it goes
+        """
+        assert self.conn is not None
 
-        return rows
+        index = SearchIndex()
 
-    def add_entry(self, title: str, username: str, password: str):
+        cur = self.conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM entries")
+        total = cur.fetchone()[0]
+
+        cur.execute("SELECT id, record FROM entries")
+        done = 0
+        while rows := cur.fetchmany(BATCH_SIZE):
+            yield ("Indexing entries", done, total)
+            for (entry_id, _), (title, username, _) in zip(rows, self.decrypt_records(rows)):
+                index.add(entry_id, title, username)
+            done += len(rows)
+
+        return index
+
+    def save_index(self):
         assert self.conn is not None
-        assert self.aes is not None
+        assert self.cipher is not None
+
+        if self.index is None or self.index_saved:
+            return
 
-        enc_title = self.aes.encrypt(title.encode())
-        enc_username = self.aes.encrypt(username.encode())
-        enc_password = self.aes.encrypt(password.encode())
+        self.set_secret("index", self.index.dumps())
+        self.index_saved = True
 
-        values = (enc_title, enc_username, enc_password)
+    def discard_saved_index(self, cur: sqlite3.Cursor):
+        # called inside every mutation so a stale index is never trusted
+        cur.execute("DELETE FROM meta WHERE k='index'")
+        self.index_saved = False
+
+    def get_secret(self, name: str):
+        """
+        Read an encrypted blob stored in meta
+        :param name: Name of the blob
+        :return: Decrypted data, None if missing or not readable with the current key
+        """
+        assert self.conn is not None
+        assert self.cipher is not None
 
         cur = self.conn.cursor()
+        cur.execute("SELECT v FROM meta WHERE k=?", (name, ))
+        row = cur.fetchone()
+        if row is None:
+            return None
+
+        try:
+            return self.cipher.decrypt(row[0], name.encode())
+        except Exception:
+            return None
+
+    def set_secret(self, name: str, data: bytes):
+        """
+        Encrypt and store a blob in meta, authenticated with its name
+        :param name: Name of the blob
+        :param data: Data to store
+        """
+        assert self.conn is not None
+        assert self.cipher is not None
 
-        cur.execute("INSERT INTO entries (title, username, password) VALUES (?, ?, ?)", values)
+        blob = self.cipher.encrypt(data, name.encode())
 
-        self.commit()
+        with self.transaction():
+            self.conn.execute("INSERT OR REPLACE INTO meta (k, v) VALUES (?, ?)", (name, blob))
 
-    def edit_entry(self, entry_id: int, title: str, username: str, password: str):
+    def subkey(self, context: bytes) -> bytes:
+        """
+        Derive a key for a purpose other than encrypting entries
+        :param context: Purpose of the key
+        :return: 256 bit subkey
+        """
+        assert self.cipher is not None
+
+        return self.cipher.subkey(context)
+
+    def search(self, query: str):
+        assert self.index is not None
+
+        return self.index.search(query)
+
+    def count_entries(self) -> int:
         assert self.conn is not None
-        assert self.aes is not None
 
-        enc_title = self.aes.encrypt(title.encode())
-        enc_username = self.aes.encrypt(username.encode())
-        enc_password = self.aes.encrypt(password.encode())
+        cur = self.conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM entries")
 
-        values = (enc_title, enc_username, enc_password, entry_id)
+        return cur.fetchone()[0]
+
+    def get_ids(self):
+        assert self.conn is not None
 
         cur = self.conn.cursor()
+        cur.execute("SELECT id FROM entries")
 
-        cur.execute("UPDATE entries SET title=?, username=?, password=? WHERE id=?", values)
+        return [entry_id for entry_id, in cur]
 
-        self.commit()
+    def get_title(self, entry_id: int) -> str:
+        assert self.conn is not None
 
-    def delete_entry(self, entry_id: int):
+        if entry_id in self.cache:
+            return self.cache[entry_id][0]
+
+        if self.index is not None:
+            return self.index.title(entry_id)
+
+        cur = self.conn.cursor()
+        cur.execute("SELECT record FROM entries WHERE id=?", (entry_id, ))
+        row = cur.fetchone()
+        if row is None:
+            raise KeyError(entry_id)
+
+        return self.decrypt_record(entry_id, row[0])[0]
+
+    def get_entry(self, entry_id: int):
         assert self.conn is not None
 
-        values = (entry_id, )
+        # most recently used entries are kept decrypted
+        if entry_id in self.cache:
+            self.cache.move_to_end(entry_id)
+            return self.cache[entry_id]
 
         cur = self.conn.cursor()
+        cur.execute("SELECT record FROM entries WHERE id=?", (entry_id, ))
+        row = cur.fetchone()
+        if row is None:
+            raise KeyError(entry_id)
+
+        entry = self.decrypt_record(entry_id, row[0])
 
-        cur.execute("DELETE FROM entries WHERE id=?", values)
+        self.cache[entry_id] = entry
+        if len(self.cache) > CACHE_SIZE:
+            self.cache.popitem(last=False)
 
-        self.commit()
+        return entry
 
-    def commit(self):
+    def iter_entries(self, strict: bool = False):
+        """
+        :param strict: Raise ValueError at an entry that fails to decrypt, see decrypt_records()
+        :return: Generator of (entry_id, title, username, password) tuples
+        """
         assert self.conn is not None
 
-        self.conn.commit()
+        cur = self.conn.cursor()
+        cur.execute("SELECT id, record FROM entries")
+        while rows := cur.fetchmany(BATCH_SIZE):
+            for (entry_id, _), entry in zip(rows, self.decrypt_records(rows, strict=strict)):
+                yield (entry_id, *entry)
+
+    def snapshot_entries(self):
+        """
+        Entries as they are now, for another thread to decrypt while the vault
+        keeps being used. They are read through a connection of their own, in a
+        read transaction that does not see later writes, and opened with the
+        current cipher, so a rekey during the iteration changes nothing.
+        :return: Generator of (entry_id, title, username, password) tuples
+        """
+        assert self.conn is not None
+        assert self.cipher is not None
+
+        conn = db.connect(self.path)
+        try:
+            # the snapshot is taken by the first read of the transaction
+            conn.execute("BEGIN")
+            cur = conn.execute("SELECT id, record FROM entries")
+        except BaseException:
+            conn.close()
+            raise
+
+        return self.read_snapshot(conn, cur, self.cipher)
+
+    def read_snapshot(self, conn: sqlite3.Connection, cur: sqlite3.Cursor, cipher):
+        try:
+            while rows := cur.fetchmany(BATCH_SIZE):
+                for (entry_id, _), entry in zip(rows, self.decrypt_records(rows, cipher)):
+                    yield (entry_id, *entry)
+        finally:
+            conn.close()
+
+    def add_entry(self, title: str, username: str, password: str):
+        assert self.conn is not None
+        assert self.cipher is not None
+
+        now = int(time.time())
+
+        with self.transaction():
+            cur = self.conn.cursor()
+            entry_id = self.next_id(cur)
+            record = self.encrypt_record(entry_id, title, username, password)
+            cur.execute(
+                "INSERT INTO entries (id, record, created, modified) VALUES (?, ?, ?, ?)",
+                (entry_id, record, now, now),
+            )
+            self.discard_saved_index(cur)
+            self.pending.append((entry_id, title, username))
+
+        return entry_id
+
+    def add_entries(self, entries):
+        """
+        Add many entries in one transaction.
+        Batches are encrypted on a helper thread while the previous batch is inserted.
+        Yields (status, done, total); closing the generator early rolls back.
+        :param entries: Iterable of (title, username, password), consumed lazily
+        :return: Number of entries added
+        """
+        assert self.conn is not None
+        assert self.cipher is not None
+
+        now = int(time.time())
+
+        def encrypt_batch(first_id, batch):
+            ids = range(first_id, first_id + len(batch))
+            records = self.encrypt_records([(entry_id, *fields) for entry_id, fields in zip(ids, batch)])
+            return [(entry_id, record, now, now) for entry_id, record in zip(ids, records)]
+
+        def insert(cur, batch, values):
+            cur.executemany(
+                "INSERT INTO entries (id, record, created, modified) VALUES (?, ?, ?, ?)",
+                values,
+            )
+            for (entry_id, *_), (title, username, _) in zip(values, batch):
+                self.pending.append((entry_id, title, username))
+
+        done = 0
+        entries = iter(entries)
+        pool = ThreadPoolExecutor(1)
+        try:
+            with self.transaction():
+                cur = self.conn.cursor()
+
+                next_id = self.next_id(cur)
+
+                pending = None
+                while True:
+                    batch = list(islice(entries, BATCH_SIZE))
+
+                    future = pool.submit(encrypt_batch, next_id, batch) if batch else None
+                    next_id += len(batch)
+
+                    if pending is not None:
+                        insert(cur, pending[0], pending[1].result())
+                        done += len(pending[0])
+                        yield ("Importing entries", done, 0)
+
+                    if future is None:
+                        break
+                    pending = (batch, future)
+
+                self.discard_saved_index(cur)
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+        return done
+
+    def edit_entry(self, entry_id: int, title: str, username: str, password: str):
+        assert self.conn is not None
+        assert self.cipher is not None
+
+        record = self.encrypt_record(entry_id, title, username, password)
+        values = (record, int(time.time()), entry_id)
+
+        with self.transaction():
+            cur = self.conn.cursor()
+            cur.execute("UPDATE entries SET record=?, modified=? WHERE id=?", values)
+            self.discard_saved_index(cur)
+            self.cache.pop(entry_id, None)
+            self.pending.append((entry_id, title, username))
+
+    def delete_entry(self, entry_id: int):
+        assert self.conn is not None
+
+        values = (entry_id, )
+
+        with self.transaction():
+            cur = self.conn.cursor()
+            cur.execute("DELETE FROM entries WHERE id=?", values)
+            self.discard_saved_index(cur)
+            self.cache.pop(entry_id, None)
+            self.pending.append((entry_id, None, None))
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group writes into one transaction. Mutations made inside it join it,
+        so many add_entry/edit_entry/delete_entry calls cost a single commit:
+
+            with v.transaction():
+                for title, username, password in entries:
+                    v.add_entry(title, username, password)
+
+        The search index only sees the changes once the outermost transaction commits.
+        """
+        assert self.conn is not None
+
+        outer = not self.conn.in_transaction
+        try:
+            with db.transaction(self.conn):
+                yield
+        except BaseException:
+            if outer:
+                # entries read inside the transaction may hold rolled back values
+                self.pending = []
+                self.cache.clear()
+            raise
+
+        if outer:
+            self.apply_pending()
+
+    def apply_pending(self):
+        pending, self.pending = self.pending, []
+        if self.index is None:
+            return
+
+        # (entry_id, None, None) marks a deleted entry
+        for entry_id, title, username in pending:
+            if title is None:
+                self.index.remove(entry_id)
+            else:
+                self.index.add(entry_id, title, username)
 
     def close(self):
         assert self.conn is not None
 
+        if self.cipher is not None:
+            self.save_index()
+
+        db.optimize(self.conn)
+        self.cache.clear()
+        self.index = None
         self.conn.close()
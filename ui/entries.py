@@ -0,0 +1,63 @@
+from PyQt6.QtCore import QAbstractListModel, QModelIndex, Qt
+
+class EntryListModel(QAbstractListModel):
+    """
+    List model over vault entry ids.
+    Titles are fetched through the loader only when a row is first painted.
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.loader = None
+        self.ids = []
+        self.rows = {}
+        self.titles = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.ids)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
+            return None
+
+        entry_id = self.ids[index.row()]
+        if entry_id not in self.titles:
+            self.titles[entry_id] = self.loader(entry_id)
+        return self.titles[entry_id]
+
+    def set_ids(self, ids):
+        self.beginResetModel()
+        self.ids = list(ids)
+        self.rows = {entry_id: row for row, entry_id in enumerate(self.ids)}
+        self.titles = {}
+        self.endResetModel()
+
+    def entry_id(self, row):
+        return self.ids[row]
+
+    def index_of(self, entry_id):
+        return self.index(self.rows[entry_id])
+
+    def append(self, entry_id, title):
+        row = len(self.ids)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.ids.append(entry_id)
+        self.rows[entry_id] = row
+        self.titles[entry_id] = title
+        self.endInsertRows()
+
+    def update(self, entry_id, title):
+        self.titles[entry_id] = title
+        index = self.index_of(entry_id)
+        self.dataChanged.emit(index, index)
+
+    def remove(self, entry_id):
+        row = self.rows.pop(entry_id)
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.ids[row]
+        self.titles.pop(entry_id, None)
+        for r in range(row, len(self.ids)):
+            self.rows[self.ids[r]] = r
+        self.endRemoveRows()
@@ -1,12 +1,15 @@
 from PyQt6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QScrollArea, QFrame,
-    QSizePolicy, QLineEdit, QMenuBar, QMenu, QTabWidget, QCheckBox, QSlider, QComboBox
+    QSizePolicy, QLineEdit, QMenuBar, QMenu, QTabWidget, QCheckBox, QSlider, QComboBox,
+    QListView, QAbstractItemView
 )
 from PyQt6.QtGui import QAction
 from PyQt6.QtCore import Qt
 
 import pyperclip
 
+from ui.entries import EntryListModel
+
 class VaultWindow(QWidget):
     def __init__(self):
         super().__init__()
@@ -56,7 +59,16 @@ class VaultWindow(QWidget):
         self.menu_bar = QMenuBar()
 
         vault_menu = QMenu("Vault", self)
+        self.menu_rekey = QAction("Change master password", self)
+        self.menu_cipher = QAction("Change cipher", self)
+        self.menu_export = QAction("Export backup", self)
+        self.menu_restore = QAction("Restore backup", self)
         self.menu_close = QAction("Exit application", self)
+        vault_menu.addAction(self.menu_rekey)
+        vault_menu.addAction(self.menu_cipher)
+        vault_menu.addAction(self.menu_export)
+        vault_menu.addAction(self.menu_restore)
+        vault_menu.addSeparator()
         vault_menu.addAction(self.menu_close)
         self.menu_bar.addMenu(vault_menu)
 
@@ -64,9 +76,12 @@ class VaultWindow(QWidget):
         self.menu_add = QAction("Add new entry", self)
         self.menu_edit = QAction("Edit current entry", self)
         self.menu_delete = QAction("Delete current entry", self)
+        self.menu_import = QAction("Import entries", self)
         entries_menu.addAction(self.menu_add)
         entries_menu.addAction(self.menu_edit)
         entries_menu.addAction(self.menu_delete)
+        entries_menu.addSeparator()
+        entries_menu.addAction(self.menu_import)
         self.menu_bar.addMenu(entries_menu)
 
         tools_menu = QMenu("Tools", self)
@@ -78,24 +93,37 @@ class VaultWindow(QWidget):
 
         self.main_layout.setMenuBar(self.menu_bar)
 
+        self.menu_rekey.setEnabled(False)
+        self.menu_cipher.setEnabled(False)
+        self.menu_export.setEnabled(False)
+        self.menu_restore.setEnabled(False)
         self.menu_add.setEnabled(False)
         self.menu_edit.setEnabled(False)
         self.menu_delete.setEnabled(False)
+        self.menu_import.setEnabled(False)
         self.menu_generator.setEnabled(False)
         self.menu_health.setEnabled(False)
 
         top_layout = QHBoxLayout()
         vault_page_layout.addLayout(top_layout)
 
-        self.left_scroll = QScrollArea()
-        self.left_scroll.setWidgetResizable(True)
-        self.left_frame = QWidget()
-        self.left_layout = QVBoxLayout()
-        self.left_layout.setAlignment(Qt.AlignmentFlag.AlignTop)
-        self.left_frame.setLayout(self.left_layout)
-        self.left_frame.setSizePolicy(QSizePolicy.Policy.Minimum, QSizePolicy.Policy.Expanding)
-        self.left_scroll.setWidget(self.left_frame)
-        top_layout.addWidget(self.left_scroll, 2)
+        # only visible rows are painted, so the list scales with vault size
+        self.entry_model = EntryListModel()
+        self.entry_list = QListView()
+        self.entry_list.setObjectName("entryList")
+        self.entry_list.setModel(self.entry_model)
+        self.entry_list.setUniformItemSizes(True)
+        self.entry_list.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.entry_list.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText("Search")
+        self.search_edit.setClearButtonEnabled(True)
+
+        left_layout = QVBoxLayout()
+        left_layout.addWidget(self.search_edit)
+        left_layout.addWidget(self.entry_list)
+        top_layout.addLayout(left_layout, 2)
 
         self.right_frame = QFrame()
         self.right_layout = QVBoxLayout()
@@ -321,10 +349,15 @@ class VaultWindow(QWidget):
         self.vault_widget.show()
 
     def enable_vault_menus(self):
+        self.menu_rekey.setEnabled(True)
+        self.menu_cipher.setEnabled(True)
+        self.menu_export.setEnabled(True)
+        self.menu_restore.setEnabled(True)
         self.menu_add.setEnabled(True)
         self.menu_edit.setEnabled(True)
         self.menu_generator.setEnabled(True)
         self.menu_delete.setEnabled(True)
+        self.menu_import.setEnabled(True)
         self.menu_health.setEnabled(True)
 
     def on_vault_open(self):
@@ -0,0 +1,46 @@
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+class WorkerSignals(QObject):
+    progress = pyqtSignal(object)
+    result = pyqtSignal(object)
+    error = pyqtSignal(object)
+    finished = pyqtSignal()
+
+class Worker(QRunnable):
+    """
+    Runs a generator function on the global thread pool.
+    Every yielded value is emitted through progress and the return value through result.
+    Cancelling stops the generator at its next yield.
+    The outcome is also kept in value and exception for finished handlers.
+    """
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self.cancelled = False
+        self.value = None
+        self.exception = None
+
+    def start(self):
+        QThreadPool.globalInstance().start(self)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        gen = self.fn(*self.args, **self.kwargs)
+        try:
+            while not self.cancelled:
+                self.signals.progress.emit(next(gen))
+            gen.close()
+        except StopIteration as e:
+            self.value = e.value
+            self.signals.result.emit(e.value)
+        except Exception as e:
+            self.exception = e
+            self.signals.error.emit(e)
+        finally:
+            self.signals.finished.emit()